@@ -1,6 +1,11 @@
-from flask import Flask, jsonify, request, Response, render_template, send_from_directory, redirect, url_for
+from flask import Flask, jsonify, request, Response, render_template, send_from_directory, redirect, url_for, \
+    stream_with_context, make_response
 import os
 import json
+import queue
+import hashlib
+import threading
+import time
 import requests
 from functools import wraps
 import logging
@@ -19,6 +24,26 @@ EC2_INSTANCE_IP = os.environ.get('EC2_INSTANCE_IP', 'localhost')
 EC2_PORT = os.environ.get('EC2_PORT', '8000')
 AUTH_USERNAME = os.environ.get('AUTH_USERNAME', 'admin')
 AUTH_PASSWORD = os.environ.get('AUTH_PASSWORD', 'secure_password')
+STATUS_POLL_INTERVAL = float(os.environ.get('STATUS_POLL_INTERVAL', '5'))
+CHANGES_LONG_POLL_TIMEOUT = float(os.environ.get('CHANGES_LONG_POLL_TIMEOUT', '25'))
+SSE_KEEPALIVE_INTERVAL = float(os.environ.get('SSE_KEEPALIVE_INTERVAL', '15'))
+ADMISSION_WAIT_TIMEOUT = float(os.environ.get('ADMISSION_WAIT_TIMEOUT', '2'))
+ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', '5'))
+
+# (concurrency, queue size) per route; cheap routes get more slots than full scan dumps
+ADMISSION_LIMITS = {
+    'default': (8, 16),
+    'health': (64, 128),
+    'status': (32, 64),
+    'critical-high': (16, 32),
+    'top-risks': (8, 16),
+    'trends': (8, 16),
+    'batch': (8, 16),
+    'scan': (4, 8),
+    'sbom': (4, 8),
+    'export': (4, 8),
+}
+ADMISSION_LIMITS.update(json.loads(os.environ.get('ADMISSION_LIMITS', '{}')))
 
 
 # Basic authentication decorator
@@ -37,6 +62,116 @@ def require_auth(f):
     return decorated
 
 
+class AdmissionController:
+    """Bounded-concurrency admission control with a short wait queue per route.
+
+    Each route gets its own pool, so cheap routes keep their capacity while full result
+    dumps queue behind each other. Requests that find the queue full, or that wait past
+    the deadline, are shed immediately with 503 and Retry-After.
+    """
+
+    def __init__(self, limits, wait_timeout, retry_after):
+        self.limits = limits
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def _pool(self, name):
+        with self._lock:
+            pool = self._pools.get(name)
+            if pool is None:
+                concurrency, max_queue = self.limits.get(name, self.limits['default'])
+                pool = {
+                    'semaphore': threading.BoundedSemaphore(concurrency),
+                    'max_queue': max_queue,
+                    'waiting': 0,
+                    'in_flight': 0,
+                    'admitted': 0,
+                    'shed_queue_full': 0,
+                    'shed_timeout': 0,
+                }
+                self._pools[name] = pool
+            return pool
+
+    def _shed(self, pool, reason):
+        with self._lock:
+            pool[f'shed_{reason}'] += 1
+        response = jsonify({"error": "Server busy, retry later"})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(self.retry_after)
+        return response
+
+    def limit(self, name):
+        """Decorator admitting at most the configured number of concurrent requests to a route"""
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                pool = self._pool(name)
+                acquired = pool['semaphore'].acquire(blocking=False)
+                if not acquired:
+                    with self._lock:
+                        if pool['waiting'] >= pool['max_queue']:
+                            queue_full = True
+                        else:
+                            queue_full = False
+                            pool['waiting'] += 1
+                    if queue_full:
+                        return self._shed(pool, 'queue_full')
+                    try:
+                        acquired = pool['semaphore'].acquire(timeout=self.wait_timeout)
+                    finally:
+                        with self._lock:
+                            pool['waiting'] -= 1
+                    if not acquired:
+                        return self._shed(pool, 'timeout')
+
+                with self._lock:
+                    pool['in_flight'] += 1
+                    pool['admitted'] += 1
+
+                def release():
+                    with self._lock:
+                        pool['in_flight'] -= 1
+                    pool['semaphore'].release()
+
+                try:
+                    response = make_response(f(*args, **kwargs))
+                except Exception:
+                    release()
+                    raise
+                if response.is_streamed:
+                    # Streaming bodies keep their slot until the client has received everything
+                    response.call_on_close(release)
+                else:
+                    release()
+                return response
+
+            return decorated
+
+        return decorator
+
+    def metrics(self):
+        """Render queue depth, in-flight and shed counters in Prometheus text format"""
+        lines = [
+            '# TYPE admission_in_flight gauge',
+            '# TYPE admission_queue_depth gauge',
+            '# TYPE admission_admitted_total counter',
+            '# TYPE admission_shed_total counter',
+        ]
+        with self._lock:
+            for name, pool in sorted(self._pools.items()):
+                lines.append(f'admission_in_flight{{route="{name}"}} {pool["in_flight"]}')
+                lines.append(f'admission_queue_depth{{route="{name}"}} {pool["waiting"]}')
+                lines.append(f'admission_admitted_total{{route="{name}"}} {pool["admitted"]}')
+                lines.append(f'admission_shed_total{{route="{name}",reason="queue_full"}} {pool["shed_queue_full"]}')
+                lines.append(f'admission_shed_total{{route="{name}",reason="timeout"}} {pool["shed_timeout"]}')
+        return '\n'.join(lines) + '\n'
+
+
+admission = AdmissionController(ADMISSION_LIMITS, ADMISSION_WAIT_TIMEOUT, ADMISSION_RETRY_AFTER)
+
+
 @app.route('/')
 def home():
     """Home page with links to dashboard and scan results"""
@@ -94,6 +229,7 @@ def home():
 
 
 @app.route('/health')
+@admission.limit('health')
 def health_check():
     """Health check endpoint for Kubernetes probes"""
     return jsonify({"status": "healthy"})
@@ -209,6 +345,15 @@ def dashboard():
             .btn:hover {
                 background-color: #1e429f;
             }
+            .trend-controls {
+                display: flex;
+                gap: 0.5rem;
+                margin-bottom: 1rem;
+            }
+            .trend-legend span {
+                margin-right: 1rem;
+                font-size: 0.875rem;
+            }
             @media (max-width: 768px) {
                 .charts-grid {
                     grid-template-columns: 1fr;
@@ -230,6 +375,21 @@ def dashboard():
             </div>
         </div>
 
+        <div class="container">
+            <div class="card">
+                <h3 class="text-lg font-semibold mb-2">Vulnerability Trends</h3>
+                <div class="trend-controls">
+                    <select id="trendImage"></select>
+                    <select id="trendBucket">
+                        <option value="day">Daily</option>
+                        <option value="week">Weekly</option>
+                        <option value="month">Monthly</option>
+                    </select>
+                </div>
+                <div id="trends-root"><p class="text-gray-600">Loading trends...</p></div>
+            </div>
+        </div>
+
         <script>
             // Fetch vulnerability data
             async function fetchVulnerabilityData() {
@@ -256,9 +416,8 @@ def dashboard():
             }
 
             // Render dashboard
-            async function renderDashboard() {
+            function renderDashboard(data) {
                 const dashboardRoot = document.getElementById('dashboard-root');
-                const data = await fetchVulnerabilityData();
 
                 if (!data) {
                     dashboardRoot.innerHTML = `
@@ -320,57 +479,328 @@ def dashboard():
                 `;
             }
 
+            const TREND_SERIES = [
+                {key: 'critical', label: 'Critical', color: '#b91c1c'},
+                {key: 'high', label: 'High', color: '#ea580c'},
+                {key: 'fixable', label: 'Fixable', color: '#047857'},
+                {key: 'total', label: 'Total', color: '#6b7280'},
+            ];
+
+            // Draw the trend points as an inline SVG line chart, one line per series
+            function renderTrends(data) {
+                const trendsRoot = document.getElementById('trends-root');
+                if (!data || data.error) {
+                    // Error text can echo request input, so it is never parsed as markup
+                    const message = document.createElement('p');
+                    message.className = 'text-gray-600';
+                    message.textContent = data && data.error ? data.error : 'Trends unavailable';
+                    trendsRoot.replaceChildren(message);
+                    return;
+                }
+
+                // Image names come from submitted scan jobs, so options are built as text, not markup
+                const imageSelect = document.getElementById('trendImage');
+                if (imageSelect.options.length !== data.images.length) {
+                    imageSelect.replaceChildren(...data.images.map((image) => new Option(image, image)));
+                }
+                imageSelect.value = data.image;
+
+                const points = data.points;
+                if (points.length === 0) {
+                    trendsRoot.innerHTML = '<p class="text-gray-600">No scans in this period</p>';
+                    return;
+                }
+
+                const width = 800, height = 240, pad = 40;
+                const maxValue = Math.max(1, ...points.map((point) => point.total));
+                const x = (i) => pad + (points.length === 1 ? (width - 2 * pad) / 2 : i * (width - 2 * pad) / (points.length - 1));
+                const y = (value) => height - pad - value * (height - 2 * pad) / maxValue;
+                const lines = TREND_SERIES.map((series) => {
+                    const coords = points.map((point, i) => `${x(i).toFixed(1)},${y(point[series.key]).toFixed(1)}`);
+                    const dots = coords.map((coord) => {
+                        const [cx, cy] = coord.split(',');
+                        return `<circle cx="${cx}" cy="${cy}" r="3" fill="${series.color}"/>`;
+                    }).join('');
+                    return `<polyline fill="none" stroke="${series.color}" stroke-width="2" points="${coords.join(' ')}"/>${dots}`;
+                }).join('');
+
+                trendsRoot.innerHTML = `
+                    <svg viewBox="0 0 ${width} ${height}" width="100%" role="img" aria-label="Vulnerability trends">
+                        <line x1="${pad}" y1="${height - pad}" x2="${width - pad}" y2="${height - pad}" stroke="#d1d5db"/>
+                        <line x1="${pad}" y1="${pad}" x2="${pad}" y2="${height - pad}" stroke="#d1d5db"/>
+                        <text x="${pad - 6}" y="${pad + 4}" font-size="12" text-anchor="end">${maxValue}</text>
+                        <text x="${pad - 6}" y="${height - pad + 4}" font-size="12" text-anchor="end">0</text>
+                        <text x="${x(0)}" y="${height - pad + 18}" font-size="12" text-anchor="start">${points[0].bucket}</text>
+                        <text x="${x(points.length - 1)}" y="${height - pad + 18}" font-size="12" text-anchor="end">${points[points.length - 1].bucket}</text>
+                        ${lines}
+                    </svg>
+                    <div class="trend-legend">
+                        ${TREND_SERIES.map((series) => `<span style="color: ${series.color}">&#9632; ${series.label}</span>`).join('')}
+                    </div>
+                `;
+            }
+
+            async function loadTrends() {
+                const params = new URLSearchParams({bucket: document.getElementById('trendBucket').value});
+                const image = document.getElementById('trendImage').value;
+                if (image) {
+                    params.set('image', image);
+                }
+                try {
+                    const response = await fetch(`/status/trends?${params}`);
+                    renderTrends(await response.json());
+                } catch (error) {
+                    console.error('Error fetching trends:', error);
+                    renderTrends(null);
+                }
+            }
+
+            // Subscribe to pushed updates, falling back to a single fetch without EventSource support
+            function initDashboard() {
+                document.getElementById('trendImage').addEventListener('change', loadTrends);
+                document.getElementById('trendBucket').addEventListener('change', loadTrends);
+                loadTrends();
+                if (!window.EventSource) {
+                    const refresh = () => fetchVulnerabilityData().then(renderDashboard);
+                    refresh();
+                    // Refresh data every 5 minutes
+                    setInterval(refresh, 300000);
+                    return;
+                }
+                const source = new EventSource('/status/stream');
+                source.addEventListener('stats', (event) => {
+                    renderDashboard(JSON.parse(event.data));
+                    // A new scan also adds a rollup to the trends
+                    loadTrends();
+                });
+                // Pushed when the EC2 server cannot be reached; stats follow once it recovers
+                source.addEventListener('unavailable', () => renderDashboard(null));
+            }
+
             // Initialize dashboard
-            document.addEventListener('DOMContentLoaded', renderDashboard);
+            document.addEventListener('DOMContentLoaded', initDashboard);
         </script>
     </body>
     </html>
     '''
 
 
+def fetch_status():
+    """Fetch vulnerability statistics from the EC2 instance, or None if they are unavailable"""
+    # Get vulnerability statistics from EC2 instance
+    response = requests.get(f"http://{EC2_INSTANCE_IP}:{EC2_PORT}/stats")
+
+    if response.status_code == 200:
+        return response.json()
+
+    # Fallback to manual calculation if stats endpoint is not available
+    response = requests.get(f"http://{EC2_INSTANCE_IP}:{EC2_PORT}/results")
+
+    if response.status_code != 200:
+        logger.error(f"Failed to fetch scan results: {response.status_code}")
+        return None
+
+    scan_data = response.json()
+
+    # Count vulnerabilities by severity
+    vuln_counts = {"Critical": 0, "High": 0, "Medium": 0, "Low": 0, "Negligible": 0, "Unknown": 0}
+
+    for match in scan_data.get('matches', []):
+        severity = match.get('vulnerability', {}).get('severity', '').capitalize()
+        if severity in vuln_counts:
+            vuln_counts[severity] += 1
+        else:
+            vuln_counts["Unknown"] += 1
+
+    # Get scan timestamp if available
+    timestamp = scan_data.get('timestamp', 'Unknown')
+
+    return {
+        "scan_time": timestamp,
+        "vulnerability_counts": vuln_counts,
+        "total_vulnerabilities": sum(vuln_counts.values()),
+        "critical_high_count": vuln_counts["Critical"] + vuln_counts["High"]
+    }
+
+
+def fetch_changes(since, timeout):
+    """Long-poll the EC2 change feed, or return None if the EC2 server does not provide one"""
+    params = {'timeout': timeout}
+    if since is not None:
+        params['since'] = since
+    response = requests.get(f"http://{EC2_INSTANCE_IP}:{EC2_PORT}/changes", params=params,
+                            timeout=timeout + 10)
+    if response.status_code != 200:
+        return None
+    return response.json()
+
+
+class StatusBroadcaster:
+    """Single upstream watch on the EC2 statistics shared by every connected dashboard.
+
+    The watcher thread only runs while at least one client is subscribed. It long-polls the
+    EC2 change feed and refetches the statistics when a new scan is published, pushing to
+    subscribers only when the scan version reported by the EC2 server changes. Subscribers
+    receive (event, payload) pairs; an 'unavailable' event is pushed once when the EC2
+    server cannot be reached, and the statistics follow as soon as it recovers.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._latest = None
+        self._latest_version = None
+        self._thread = None
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=1)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._latest is not None:
+                subscriber.put_nowait(self._latest)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch, name='status-watch', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _watch(self):
+        # Position in the EC2 change feed; None until the first long poll has returned
+        cursor = None
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                changes = fetch_changes(cursor, 0 if cursor is None else CHANGES_LONG_POLL_TIMEOUT)
+                if changes is None:
+                    # EC2 servers without a change feed are polled instead
+                    cursor = None
+                    self._refresh()
+                    time.sleep(self.interval)
+                    continue
+                if cursor is None or changes['events'] or changes['reset']:
+                    self._refresh()
+                cursor = changes['last_seq']
+            except Exception as e:
+                logger.error(f"Error watching status: {str(e)}")
+                self._publish_unavailable()
+                cursor = None
+                time.sleep(self.interval)
+
+    def _refresh(self):
+        stats = fetch_status()
+        if stats is None:
+            self._publish_unavailable()
+        else:
+            self._publish(stats)
+
+    def _publish(self, stats):
+        version = stats.get('scan_version')
+        if version is None:
+            # Older EC2 servers do not report a version, fall back to a digest of the payload
+            version = hashlib.sha256(json.dumps(stats, sort_keys=True).encode()).hexdigest()
+        if version == self._latest_version:
+            return
+        self._push(('stats', stats), version)
+
+    def _publish_unavailable(self):
+        if self._latest is not None and self._latest[0] == 'unavailable':
+            return
+        # Forget the version so the same stats are pushed again once the EC2 server is back
+        self._push(('unavailable', {'error': 'Vulnerability statistics are unavailable'}), None)
+
+    def _push(self, item, version):
+        with self._lock:
+            self._latest = item
+            self._latest_version = version
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            # Slow clients only ever need the newest item, so replace anything still queued
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                subscriber.put_nowait(item)
+            except queue.Full:
+                pass
+
+
+status_broadcaster = StatusBroadcaster(STATUS_POLL_INTERVAL)
+
+
 @app.route('/status')
+@admission.limit('status')
 def status():
     """API endpoint for vulnerability statistics"""
     try:
-        # Get vulnerability statistics from EC2 instance
-        response = requests.get(f"http://{EC2_INSTANCE_IP}:{EC2_PORT}/stats")
-
-        if response.status_code == 200:
-            return jsonify(response.json())
-        else:
-            # Fallback to manual calculation if stats endpoint is not available
-            response = requests.get(f"http://{EC2_INSTANCE_IP}:{EC2_PORT}/results")
-
-            if response.status_code == 200:
-                scan_data = response.json()
-
-                # Count vulnerabilities by severity
-                vuln_counts = {"Critical": 0, "High": 0, "Medium": 0, "Low": 0, "Negligible": 0, "Unknown": 0}
-
-                for match in scan_data.get('matches', []):
-                    severity = match.get('vulnerability', {}).get('severity', '').capitalize()
-                    if severity in vuln_counts:
-                        vuln_counts[severity] += 1
-                    else:
-                        vuln_counts["Unknown"] += 1
-
-                # Get scan timestamp if available
-                timestamp = scan_data.get('timestamp', 'Unknown')
-
-                return jsonify({
-                    "scan_time": timestamp,
-                    "vulnerability_counts": vuln_counts,
-                    "total_vulnerabilities": sum(vuln_counts.values()),
-                    "critical_high_count": vuln_counts["Critical"] + vuln_counts["High"]
-                })
-            else:
-                return jsonify({"error": f"Failed to fetch scan results: {response.status_code}"}), 500
+        stats = fetch_status()
+        if stats is None:
+            return jsonify({"error": "Failed to fetch scan results"}), 500
+        return jsonify(stats)
     except Exception as e:
         logger.error(f"Error generating status: {str(e)}")
         return jsonify({"error": f"Error generating status: {str(e)}"}), 500
 
 
+def fetch_trends(args):
+    """Relay a trend query (image, from, to, bucket) to the EC2 instance"""
+    return requests.get(f"http://{EC2_INSTANCE_IP}:{EC2_PORT}/trends",
+                        params={name: args.get(name) for name in ('image', 'from', 'to', 'bucket')})
+
+
+@app.route('/status/trends')
+@admission.limit('trends')
+def status_trends():
+    """Vulnerability trends for the dashboard chart"""
+    try:
+        response = fetch_trends(request.args)
+        if response.status_code in (200, 400, 404):
+            return Response(response.content, status=response.status_code, mimetype='application/json')
+        return jsonify({"error": f"Failed to fetch trends: {response.status_code}"}), 500
+    except Exception as e:
+        logger.error(f"Error fetching trends: {str(e)}")
+        return jsonify({"error": f"Error fetching trends: {str(e)}"}), 500
+
+
+@app.route('/status/stream')
+def status_stream():
+    """Server-Sent Events stream that pushes vulnerability statistics whenever the scan changes.
+
+    A 'stats' event carries the statistics and an 'unavailable' event reports that the EC2
+    server cannot be reached.
+    """
+    subscriber = status_broadcaster.subscribe()
+
+    def generate():
+        try:
+            yield f"retry: {int(STATUS_POLL_INTERVAL * 1000)}\n\n"
+            while True:
+                try:
+                    event, payload = subscriber.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    # Comment lines keep proxies and load balancers from closing idle connections
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            status_broadcaster.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
 @app.route('/scan', methods=['GET'])
+@admission.limit('scan')
 @require_auth
 def get_scan_results():
     """Protected endpoint for full vulnerability scan details"""
@@ -709,6 +1139,7 @@ def get_scan_results():
 
 
 @app.route('/sbom', methods=['GET'])
+@admission.limit('sbom')
 @require_auth
 def get_sbom():
     """Protected endpoint for SBOM data"""
@@ -727,14 +1158,17 @@ def get_sbom():
 
 
 @app.route('/api/scan', methods=['GET'])
+@admission.limit('scan')
 @require_auth
 def api_scan_results():
     """JSON API endpoint for scan results (for programmatic access)"""
     try:
-        response = requests.get(f"http://{EC2_INSTANCE_IP}:{EC2_PORT}/results")
+        # Projection happens on the EC2 server so only the trimmed payload crosses the network
+        response = requests.get(f"http://{EC2_INSTANCE_IP}:{EC2_PORT}/results",
+                                params={'fields': request.args.get('fields')})
 
         if response.status_code == 200:
-            return jsonify(response.json())
+            return Response(response.content, mimetype='application/json')
         else:
             return jsonify({"error": f"Failed to fetch scan results: {response.status_code}"}), 500
     except Exception as e:
@@ -743,14 +1177,16 @@ def api_scan_results():
 
 
 @app.route('/api/critical-high', methods=['GET'])
+@admission.limit('critical-high')
 @require_auth
 def api_critical_high():
     """JSON API endpoint for critical and high vulnerabilities only"""
     try:
-        response = requests.get(f"http://{EC2_INSTANCE_IP}:{EC2_PORT}/critical-high")
+        response = requests.get(f"http://{EC2_INSTANCE_IP}:{EC2_PORT}/critical-high",
+                                params={'fields': request.args.get('fields')})
 
         if response.status_code == 200:
-            return jsonify(response.json())
+            return Response(response.content, mimetype='application/json')
         else:
             return jsonify({"error": f"Failed to fetch critical/high vulnerabilities: {response.status_code}"}), 500
     except Exception as e:
@@ -758,6 +1194,99 @@ def api_critical_high():
         return jsonify({"error": f"Error fetching critical/high vulnerabilities: {str(e)}"}), 500
 
 
+@app.route('/api/top-risks', methods=['GET'])
+@admission.limit('top-risks')
+@require_auth
+def api_top_risks():
+    """JSON API endpoint for vulnerabilities ranked by EPSS, CVSS and fix availability"""
+    try:
+        response = requests.get(f"http://{EC2_INSTANCE_IP}:{EC2_PORT}/top-risks",
+                                params={name: request.args.get(name) for name in ('n', 'image', 'fields')})
+
+        if response.status_code == 200:
+            return Response(response.content, mimetype='application/json')
+        elif response.status_code in (400, 404):
+            return Response(response.content, status=response.status_code, mimetype='application/json')
+        else:
+            return jsonify({"error": f"Failed to fetch top risks: {response.status_code}"}), 500
+    except Exception as e:
+        logger.error(f"Error in API top-risks endpoint: {str(e)}")
+        return jsonify({"error": f"Error fetching top risks: {str(e)}"}), 500
+
+
+@app.route('/api/trends', methods=['GET'])
+@admission.limit('trends')
+@require_auth
+def api_trends():
+    """JSON API endpoint for severity trends of an image over time"""
+    try:
+        response = fetch_trends(request.args)
+
+        if response.status_code in (200, 400, 404):
+            return Response(response.content, status=response.status_code, mimetype='application/json')
+        else:
+            return jsonify({"error": f"Failed to fetch trends: {response.status_code}"}), 500
+    except Exception as e:
+        logger.error(f"Error in API trends endpoint: {str(e)}")
+        return jsonify({"error": f"Error fetching trends: {str(e)}"}), 500
+
+
+@app.route('/api/export', methods=['GET'])
+@admission.limit('export')
+@require_auth
+def api_export():
+    """Streaming CSV or NDJSON export of scan results, optionally filtered by severity"""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"error": f"Unsupported export format: {export_format}"}), 400
+    try:
+        response = requests.get(f"http://{EC2_INSTANCE_IP}:{EC2_PORT}/export", stream=True,
+                                params={'format': export_format, 'severity': request.args.getlist('severity')})
+
+        if response.status_code != 200:
+            response.close()
+            return jsonify({"error": f"Failed to export scan results: {response.status_code}"}), 500
+
+        def generate():
+            # Relay the export chunk by chunk instead of buffering the whole body
+            with response:
+                yield from response.iter_content(chunk_size=64 * 1024)
+
+        return Response(stream_with_context(generate()), content_type=response.headers.get('Content-Type'),
+                        headers={'Content-Disposition': response.headers.get(
+                            'Content-Disposition', f'attachment; filename=vulnerability_scan.{export_format}')})
+    except Exception as e:
+        logger.error(f"Error in API export endpoint: {str(e)}")
+        return jsonify({"error": f"Error exporting scan results: {str(e)}"}), 500
+
+
+@app.route('/api/batch', methods=['POST'])
+@admission.limit('batch')
+@require_auth
+def api_batch():
+    """JSON API endpoint running several stats, critical-high and results queries in one round-trip"""
+    try:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get('queries'), list):
+            return jsonify({"error": "Request body must be a JSON object with a list of queries"}), 400
+
+        response = requests.post(f"http://{EC2_INSTANCE_IP}:{EC2_PORT}/batch", json=body)
+
+        if response.status_code == 200:
+            return jsonify(response.json())
+        else:
+            return jsonify({"error": f"Failed to run batch query: {response.status_code}"}), 500
+    except Exception as e:
+        logger.error(f"Error in API batch endpoint: {str(e)}")
+        return jsonify({"error": f"Error running batch query: {str(e)}"}), 500
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for admission control"""
+    return Response(admission.metrics(), mimetype='text/plain; version=0.0.4')
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     """Handle 404 errors"""
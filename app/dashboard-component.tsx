@@ -32,10 +32,26 @@ const VulnerabilityDashboard = () => {
       }
     };
 
-    fetchData();
-    // Refresh data every 5 minutes
-    const interval = setInterval(fetchData, 300000);
-    return () => clearInterval(interval);
+    if (typeof EventSource === 'undefined') {
+      fetchData();
+      // Refresh data every 5 minutes
+      const interval = setInterval(fetchData, 300000);
+      return () => clearInterval(interval);
+    }
+
+    // The server pushes new stats whenever the scan changes
+    const source = new EventSource('/status/stream');
+    source.addEventListener('stats', (event) => {
+      setData(JSON.parse(event.data));
+      setError(null);
+      setLoading(false);
+    });
+    // Pushed when the EC2 server cannot be reached; stats follow once it recovers
+    source.addEventListener('unavailable', (event) => {
+      setError(JSON.parse(event.data).error);
+      setLoading(false);
+    });
+    return () => source.close();
   }, []);
 
   if (loading) {
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+import scan_image
+
+
+def run_scan(image_name, output_dir, **scan_options):
+    """Scan an image into output_dir and return the wall-clock seconds and stage timings"""
+    start = time.monotonic()
+    result = scan_image.scan_image(image_name, output_dir, **scan_options)
+    return round(time.monotonic() - start, 2), result['timings']
+
+
+def benchmark_sbom_first(args):
+    """Compare separate Grype and Syft analysis with SBOM-first scanning, cold and warm"""
+    for image_name in args.images:
+        with tempfile.TemporaryDirectory() as work_dir:
+            cache_dir = os.path.join(work_dir, 'sbom-cache')
+            modes = [
+                ('separate', {}),
+                ('sbom-first (cold cache)', {'sbom_first': True, 'sbom_cache_dir': cache_dir}),
+                ('sbom-first (warm cache)', {'sbom_first': True, 'sbom_cache_dir': cache_dir}),
+            ]
+            rows = []
+            for name, options in modes:
+                seconds, timings = run_scan(image_name, os.path.join(work_dir, 'out'), **options)
+                rows.append((name, seconds, timings))
+
+        baseline = rows[0][1]
+        print(f"{image_name}:")
+        for name, seconds, timings in rows:
+            saving = baseline - seconds
+            stage_times = ", ".join(f"{stage} {t}s" for stage, t in timings.items() if stage != 'total')
+            print(f"  {name:<24} {seconds:>8.2f}s  saving {saving:>7.2f}s  ({stage_times})")
+
+
+# Child processes parse one file so each peak RSS measurement starts from a clean interpreter
+PARSE_CHILD = {
+    'json.load': """
+import json, sys
+with open(sys.argv[1]) as f:
+    scan_data = json.load(f)
+rows = [m for m in scan_data.get('matches', [])
+        if m.get('vulnerability', {}).get('severity', '').upper() in ('CRITICAL', 'HIGH')]
+""",
+    'streaming': """
+import os, sys
+sys.path.insert(0, sys.argv[2])
+import scan_image
+scan_image.parse_critical_and_high_vulnerabilities(sys.argv[1], os.devnull, os.devnull)
+""",
+}
+
+
+def write_synthetic_scan(sample_file, output_file, target_bytes):
+    """Write a Grype document of roughly target_bytes by repeating the matches of a real scan"""
+    with open(sample_file, 'r') as f:
+        sample = json.load(f)
+    matches = [json.dumps(match) for match in sample.get('matches', [])]
+    written = 0
+    with open(output_file, 'w') as f:
+        f.write('{"matches": [')
+        while written < target_bytes:
+            for match in matches:
+                if written:
+                    f.write(',')
+                f.write(match)
+                written += len(match) + 1
+        f.write('], ')
+        f.write(json.dumps({key: value for key, value in sample.items() if key != 'matches'})[1:])
+
+
+def measure_parse(mode, scan_file):
+    """Run one parse in a child process and return its wall-clock seconds and peak RSS in MB"""
+    start = time.monotonic()
+    process = subprocess.Popen([sys.executable, '-c', PARSE_CHILD[mode], scan_file,
+                                os.path.dirname(os.path.abspath(__file__))], stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is reported in kilobytes on Linux
+    return round(time.monotonic() - start, 2), round(usage.ru_maxrss / 1024, 1)
+
+
+def benchmark_parse(args):
+    """Peak RSS of json.load against the streaming parser as the Grype output grows"""
+    print(f"{'input MB':>9} {'json.load MB':>13} {'streaming MB':>13} {'json.load s':>12} {'streaming s':>12}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size_mb in args.sizes:
+            scan_file = os.path.join(work_dir, f"scan_{size_mb}.json")
+            write_synthetic_scan(args.sample, scan_file, size_mb * 1024 * 1024)
+            load_seconds, load_rss = measure_parse('json.load', scan_file)
+            stream_seconds, stream_rss = measure_parse('streaming', scan_file)
+            print(f"{size_mb:>9} {load_rss:>13} {stream_rss:>13} {load_seconds:>12} {stream_seconds:>12}")
+            os.unlink(scan_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the scanning pipeline')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    sbom_first = subparsers.add_parser('sbom-first', help='Wall-clock saving of --sbom-first per image')
+    sbom_first.add_argument('images', nargs='+', help='Images to benchmark')
+    sbom_first.set_defaults(func=benchmark_sbom_first)
+
+    parse = subparsers.add_parser('parse', help='Peak RSS of the critical/high parser against input size')
+    parse.add_argument('--sample', default='vulnerability_scan.json',
+                       help='Grype output whose matches are repeated (default: vulnerability_scan.json)')
+    parse.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 100, 200],
+                       help='Synthetic input sizes in MB (default: 10 50 100 200)')
+    parse.set_defaults(func=benchmark_parse)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,27 @@
-from flask import Flask, jsonify, send_file, request
+from flask import Flask, jsonify, send_file, request, Response, make_response, stream_with_context
 import os
+import io
+import csv
 import json
+import math
+import time
+import heapq
+import uuid
+import queue
+import ctypes
+import select
+import struct
+import sqlite3
+import threading
+import ctypes.util
+from datetime import datetime, timedelta
+from functools import wraps
+from collections import OrderedDict, deque
+
+from scan_image import VULNERABILITY_FIELDS, vulnerability_row, image_slug, compute_vulnerability_stats, \
+    ScanSnapshot, ScanManifest, PackageIndex, ScanStore, TrendStore, scan_image, match_risk_inputs, FIX_STATES, \
+    is_valid_image_reference, iter_grype_matches, snapshot_row, single_precision, \
+    claim_image_dir, image_dir_owner
 
 app = Flask(__name__)
 
@@ -16,19 +37,903 @@ try:
     SBOM_PATH = config.get('sbom_path', 'sbom.json')
     CRITICAL_HIGH_VULNS_PATH = config.get('critical_high_vulns_path', 'critical_high_vulns.json')
 
+    # Per-image results written by scan_image.py --images
+    SCANS_DIR = config.get('scans_dir', 'scans')
+
     # Set port
     PORT = config.get('port', 8000)
 
     # Set allowed origins
     ALLOWED_ORIGINS = config.get('allowed_origins', ['*'])
+
+    # Per-route (concurrency, queue size) overrides for admission control
+    ADMISSION_LIMITS = config.get('admission_limits', {})
+
+    # Scan job queue
+    JOBS_DB_PATH = config.get('jobs_db_path', 'scan_jobs.db')
+    SCAN_WORKERS = config.get('scan_workers', 2)
+    S3_BUCKET = config.get('s3_bucket')
+
+    # Package index maintained by scan_image.py
+    PACKAGE_INDEX_PATH = config.get('package_index_path', os.path.join(SCANS_DIR, 'package-index.db'))
+
+    # Weights of EPSS percentile, CVSS base score and fix availability in /top-risks
+    RISK_WEIGHTS = config.get('risk_weights', {})
+
+    # Deduplicated scan history; queued scans are added to it when set
+    SCAN_STORE_PATH = config.get('scan_store_path')
+
+    # Per-scan rollups appended by scan_image.py
+    TRENDS_PATH = config.get('trends_path', os.path.join(SCANS_DIR, 'trends.db'))
 except Exception as e:
     print(f"Error loading config: {str(e)}")
     # Default values
     SCAN_RESULTS_PATH = os.environ.get('SCAN_RESULTS_PATH', 'vulnerability_scan.json')
     SBOM_PATH = os.environ.get('SBOM_PATH', 'sbom.json')
     CRITICAL_HIGH_VULNS_PATH = os.environ.get('CRITICAL_HIGH_VULNS_PATH', 'critical_high_vulns.json')
+    SCANS_DIR = os.environ.get('SCANS_DIR', 'scans')
     PORT = int(os.environ.get('PORT', 8000))
     ALLOWED_ORIGINS = ['*']
+    ADMISSION_LIMITS = {}
+    JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH', 'scan_jobs.db')
+    SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS', 2))
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    PACKAGE_INDEX_PATH = os.environ.get('PACKAGE_INDEX_PATH', os.path.join(SCANS_DIR, 'package-index.db'))
+    RISK_WEIGHTS = {}
+    SCAN_STORE_PATH = os.environ.get('SCAN_STORE_PATH')
+    TRENDS_PATH = os.environ.get('TRENDS_PATH', os.path.join(SCANS_DIR, 'trends.db'))
+
+ADMISSION_WAIT_TIMEOUT = float(os.environ.get('ADMISSION_WAIT_TIMEOUT', '2'))
+ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', '5'))
+
+# Published-scan watcher and /changes feed
+WATCH_POLL_INTERVAL = float(os.environ.get('WATCH_POLL_INTERVAL', '2'))
+WATCH_SETTLE_INTERVAL = float(os.environ.get('WATCH_SETTLE_INTERVAL', '0.25'))
+CHANGE_FEED_SIZE = int(os.environ.get('CHANGE_FEED_SIZE', '1000'))
+CHANGES_MAX_TIMEOUT = float(os.environ.get('CHANGES_MAX_TIMEOUT', '60'))
+
+DEFAULT_RISK_WEIGHTS = {'epss': 0.5, 'cvss': 0.35, 'fix': 0.15}
+RISK_WEIGHTS = {**DEFAULT_RISK_WEIGHTS, **RISK_WEIGHTS}
+TOP_RISKS_MAX = int(os.environ.get('TOP_RISKS_MAX', '500'))
+
+# Cheap summary routes get more slots than full result dumps so they stay responsive under load
+DEFAULT_ADMISSION_LIMITS = {
+    'default': (4, 8),
+    'health': (32, 64),
+    'stats': (16, 32),
+    'critical-high': (8, 16),
+    # Served from the snapshot when there is one, but parse the whole scan without it
+    'vulnerabilities': (4, 8),
+    'top-risks': (4, 8),
+    'batch': (4, 8),
+    'results': (2, 4),
+    'sbom': (2, 4),
+    'download': (2, 4),
+    'export': (2, 4),
+    'scans': (4, 8),
+    'changes': (64, 16),
+    'packages': (16, 32),
+    'history': (4, 8),
+    'trends': (8, 16),
+}
+
+
+def get_scan_version(path):
+    """Return an identifier that changes whenever the file behind path is replaced or rewritten"""
+    real_path = os.path.realpath(path)
+    st = os.stat(real_path)
+    return f"{os.path.basename(real_path)}:{st.st_mtime_ns}:{st.st_size}"
+
+
+# Parsed documents take several times their file size, so the cache is bounded by the
+# total size of the files behind it and the least recently used documents are dropped first
+JSON_CACHE_BYTES = int(os.environ.get('JSON_CACHE_BYTES', str(64 * 1024 * 1024)))
+_json_cache = OrderedDict()
+_json_cache_bytes = 0
+_json_cache_lock = threading.Lock()
+
+
+def load_json(path):
+    """Load a JSON file, reusing the parsed document until the file changes.
+
+    The returned object is shared between requests and must not be modified.
+    """
+    global _json_cache_bytes
+    version = get_scan_version(path)
+    with _json_cache_lock:
+        cached = _json_cache.get(path)
+        if cached and cached[0] == version:
+            _json_cache.move_to_end(path)
+            return cached[2]
+
+    with open(path, 'r') as f:
+        size = os.fstat(f.fileno()).st_size
+        data = json.load(f)
+    with _json_cache_lock:
+        previous = _json_cache.pop(path, None)
+        if previous:
+            _json_cache_bytes -= previous[1]
+        if size <= JSON_CACHE_BYTES:
+            _json_cache[path] = (version, size, data)
+            _json_cache_bytes += size
+        while _json_cache_bytes > JSON_CACHE_BYTES:
+            _, (_, evicted_size, _) = _json_cache.popitem(last=False)
+            _json_cache_bytes -= evicted_size
+    return data
+
+
+_snapshot_cache = {}
+_snapshot_cache_lock = threading.Lock()
+
+
+def snapshot_path_for(scan_path):
+    """Return the columnar snapshot published next to a scan file"""
+    return os.path.splitext(scan_path)[0] + '.snap'
+
+
+def open_snapshot(scan_path):
+    """Return the memory-mapped snapshot for a scan, or None if none was published.
+
+    Opening only maps the file, so switching to a new scan costs next to nothing and the
+    pages are shared with every other worker process that maps the same snapshot.
+    """
+    path = snapshot_path_for(scan_path)
+    try:
+        version = get_scan_version(path)
+    except FileNotFoundError:
+        return None
+    # A snapshot is only used while both links point at the same scan, e.g. not mid-publish
+    if os.path.realpath(path) != snapshot_path_for(os.path.realpath(scan_path)):
+        return None
+    with _snapshot_cache_lock:
+        cached = _snapshot_cache.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+        snapshot = ScanSnapshot(os.path.realpath(path))
+        _snapshot_cache[path] = (version, snapshot)
+        return snapshot
+
+
+def match_filter(severity=None, package=None, fixable=None):
+    """Return a predicate selecting Grype matches by severity names, package name and fix availability"""
+    severities = {s.upper() for s in severity} if severity else None
+
+    def accept(match):
+        vulnerability = match.get('vulnerability', {})
+        if severities and vulnerability.get('severity', '').upper() not in severities:
+            return False
+        if package and match.get('artifact', {}).get('name') != package:
+            return False
+        if fixable is not None and (vulnerability.get('fix', {}).get('state') == 'fixed') != fixable:
+            return False
+        return True
+    return accept
+
+
+def filter_matches(matches, severity=None, package=None, fixable=None):
+    """Filter Grype matches by severity names, package name and fix availability"""
+    return list(filter(match_filter(severity, package, fixable), matches))
+
+
+def resolve_scan_paths(image=None):
+    """Return the scan, SBOM and critical/high paths holding results for image"""
+    if image:
+        image_dir = os.path.join(SCANS_DIR, image_slug(image))
+        if os.path.isdir(image_dir):
+            # Another reference with the same slug must not be answered with this image's results
+            if image_dir_owner(image_dir) not in (None, image):
+                raise LookupError(f"No scan results for image {image}")
+            return (os.path.join(image_dir, os.path.basename(SCAN_RESULTS_PATH)),
+                    os.path.join(image_dir, os.path.basename(SBOM_PATH)),
+                    os.path.join(image_dir, os.path.basename(CRITICAL_HIGH_VULNS_PATH)))
+
+        # Fall back to the single-image results in the working directory, reading the image
+        # from the snapshot header rather than parsing the whole scan when there is one
+        snapshot = open_snapshot(SCAN_RESULTS_PATH)
+        if snapshot:
+            scanned_image = snapshot.metadata.get('image')
+        else:
+            scanned_image = load_json(SCAN_RESULTS_PATH).get('source', {}).get('target', {}).get('userInput')
+        if image != scanned_image:
+            raise LookupError(f"No scan results for image {image}")
+    return SCAN_RESULTS_PATH, SBOM_PATH, CRITICAL_HIGH_VULNS_PATH
+
+
+def parse_fields(value):
+    """Parse a comma separated list of dotted field paths into a projection tree"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    # A None subtree selects the whole value, so a path ending at a node keeps everything
+    # under it even when a longer path through the same node is also given
+    tree = {}
+    for path in value:
+        path = path.strip()
+        if not path:
+            continue
+        *parents, leaf = path.split('.')
+        node = tree
+        for part in parents:
+            if part in node and node[part] is None:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[leaf] = None
+    return tree or None
+
+
+def project(data, tree):
+    """Keep only the fields selected by a projection tree, descending through lists"""
+    if not tree:
+        return data
+    if isinstance(data, list):
+        return [project(item, tree) for item in data]
+    if isinstance(data, dict):
+        return {key: project(data[key], subtree) for key, subtree in tree.items() if key in data}
+    return data
+
+
+# Encoded bodies range from a few bytes to a whole scan, so the cache is bounded by total size
+ENCODED_CACHE_BYTES = int(os.environ.get('ENCODED_CACHE_BYTES', str(32 * 1024 * 1024)))
+_encoded_cache = OrderedDict()
+_encoded_cache_bytes = 0
+_encoded_cache_lock = threading.Lock()
+
+
+def encoded_json_response(path, variant, build):
+    """Serve the JSON encoding of build(), cached per (file version, variant) pair"""
+    global _encoded_cache_bytes
+    key = (path, get_scan_version(path), variant)
+    with _encoded_cache_lock:
+        body = _encoded_cache.get(key)
+        if body is not None:
+            _encoded_cache.move_to_end(key)
+    if body is None:
+        body = json.dumps(build(), separators=(',', ':')).encode()
+        with _encoded_cache_lock:
+            if key not in _encoded_cache and len(body) <= ENCODED_CACHE_BYTES:
+                _encoded_cache[key] = body
+                _encoded_cache_bytes += len(body)
+            while _encoded_cache_bytes > ENCODED_CACHE_BYTES:
+                _, evicted = _encoded_cache.popitem(last=False)
+                _encoded_cache_bytes -= len(evicted)
+    return Response(body, mimetype='application/json')
+
+
+def risk_score(epss_percentile, cvss, fixed):
+    """Composite risk from the EPSS percentile, the CVSS base score out of 10 and fix availability.
+
+    Missing EPSS or CVSS data contributes nothing, and a fix makes a finding more actionable.
+    """
+    score = 0.0
+    if not math.isnan(epss_percentile):
+        score += RISK_WEIGHTS['epss'] * epss_percentile
+    if not math.isnan(cvss):
+        score += RISK_WEIGHTS['cvss'] * cvss / 10
+    if fixed:
+        score += RISK_WEIGHTS['fix']
+    return round(score, 4)
+
+
+def scored_matches(matches):
+    """Yield (score, row) for each Grype match, with rows shaped like snapshot rows"""
+    for match in matches:
+        # Score the single-precision values a snapshot would hold, so both sources rank alike
+        _, epss_percentile, cvss = (single_precision(value) for value in match_risk_inputs(match))
+        row = snapshot_row(match)
+        yield risk_score(epss_percentile, cvss, row['fix_state'] == 'fixed'), row
+
+
+# Each ranking holds at most TOP_RISKS_MAX rows, so a count bound keeps the size in check
+RISK_RANKINGS_SIZE = 32
+_risk_rankings = OrderedDict()
+_risk_rankings_lock = threading.Lock()
+
+
+def rank_risks(scan_path):
+    """Return the TOP_RISKS_MAX highest-risk rows of a scan, best first.
+
+    The ranking is built once per scan version with a bounded heap, so requests for any
+    n up to TOP_RISKS_MAX only slice it.
+    """
+    key = (scan_path, get_scan_version(scan_path))
+    with _risk_rankings_lock:
+        ranking = _risk_rankings.get(key)
+        if ranking is not None:
+            _risk_rankings.move_to_end(key)
+            return ranking
+
+    snapshot = open_snapshot(scan_path)
+    if snapshot:
+        columns = snapshot.columns
+        fixed = FIX_STATES.index('fixed')
+        scores = [risk_score(columns['epss_percentile'][i], columns['cvss'][i], columns['fix_state'][i] == fixed)
+                  for i in range(snapshot.rows)]
+        top = heapq.nlargest(TOP_RISKS_MAX, range(snapshot.rows), key=scores.__getitem__)
+        ranking = [dict(snapshot.row(i), score=scores[i]) for i in top]
+    else:
+        top = heapq.nlargest(TOP_RISKS_MAX, scored_matches(load_json(scan_path).get('matches', [])),
+                             key=lambda scored: scored[0])
+        ranking = [dict(row, score=score) for score, row in top]
+
+    with _risk_rankings_lock:
+        _risk_rankings[key] = ranking
+        while len(_risk_rankings) > RISK_RANKINGS_SIZE:
+            _risk_rankings.popitem(last=False)
+    return ranking
+
+
+def parse_bool(value):
+    """Parse an optional boolean query parameter"""
+    if value is None:
+        return None
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+class AdmissionController:
+    """Bounded-concurrency admission control with a short wait queue per route.
+
+    Each route gets its own pool, so cheap routes keep their capacity while full result
+    dumps queue behind each other. Requests that find the queue full, or that wait past
+    the deadline, are shed immediately with 503 and Retry-After.
+    """
+
+    def __init__(self, limits, wait_timeout, retry_after):
+        self.limits = limits
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def _pool(self, name):
+        with self._lock:
+            pool = self._pools.get(name)
+            if pool is None:
+                concurrency, max_queue = self.limits.get(name, self.limits['default'])
+                pool = {
+                    'semaphore': threading.BoundedSemaphore(concurrency),
+                    'max_queue': max_queue,
+                    'waiting': 0,
+                    'in_flight': 0,
+                    'admitted': 0,
+                    'shed_queue_full': 0,
+                    'shed_timeout': 0,
+                }
+                self._pools[name] = pool
+            return pool
+
+    def _shed(self, pool, reason):
+        with self._lock:
+            pool[f'shed_{reason}'] += 1
+        response = jsonify({"error": "Server busy, retry later"})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(self.retry_after)
+        return response
+
+    def limit(self, name):
+        """Decorator admitting at most the configured number of concurrent requests to a route"""
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                pool = self._pool(name)
+                acquired = pool['semaphore'].acquire(blocking=False)
+                if not acquired:
+                    with self._lock:
+                        if pool['waiting'] >= pool['max_queue']:
+                            queue_full = True
+                        else:
+                            queue_full = False
+                            pool['waiting'] += 1
+                    if queue_full:
+                        return self._shed(pool, 'queue_full')
+                    try:
+                        acquired = pool['semaphore'].acquire(timeout=self.wait_timeout)
+                    finally:
+                        with self._lock:
+                            pool['waiting'] -= 1
+                    if not acquired:
+                        return self._shed(pool, 'timeout')
+
+                with self._lock:
+                    pool['in_flight'] += 1
+                    pool['admitted'] += 1
+
+                def release():
+                    with self._lock:
+                        pool['in_flight'] -= 1
+                    pool['semaphore'].release()
+
+                try:
+                    response = make_response(f(*args, **kwargs))
+                except Exception:
+                    release()
+                    raise
+                if response.is_streamed:
+                    # Streaming bodies keep their slot until the client has received everything
+                    response.call_on_close(release)
+                else:
+                    release()
+                return response
+
+            return decorated
+
+        return decorator
+
+    def metrics(self):
+        """Render queue depth, in-flight and shed counters in Prometheus text format"""
+        lines = [
+            '# TYPE admission_in_flight gauge',
+            '# TYPE admission_queue_depth gauge',
+            '# TYPE admission_admitted_total counter',
+            '# TYPE admission_shed_total counter',
+        ]
+        with self._lock:
+            for name, pool in sorted(self._pools.items()):
+                lines.append(f'admission_in_flight{{route="{name}"}} {pool["in_flight"]}')
+                lines.append(f'admission_queue_depth{{route="{name}"}} {pool["waiting"]}')
+                lines.append(f'admission_admitted_total{{route="{name}"}} {pool["admitted"]}')
+                lines.append(f'admission_shed_total{{route="{name}",reason="queue_full"}} {pool["shed_queue_full"]}')
+                lines.append(f'admission_shed_total{{route="{name}",reason="timeout"}} {pool["shed_timeout"]}')
+        return '\n'.join(lines) + '\n'
+
+
+admission = AdmissionController(
+    {**DEFAULT_ADMISSION_LIMITS, **{name: tuple(limit) for name, limit in ADMISSION_LIMITS.items()}},
+    ADMISSION_WAIT_TIMEOUT, ADMISSION_RETRY_AFTER)
+
+
+class ScanJobQueue:
+    """Persistent scan job queue drained by a fixed pool of worker threads.
+
+    Jobs are stored in SQLite so queued work survives a restart, and a request for an
+    image that is already queued or running with the same options returns the existing
+    job. Scans writing to the same directory never run concurrently.
+    """
+
+    OPTIONS = ('sbom_first', 'force', 'compress')
+
+    def __init__(self, db_path, workers):
+        self.db_path = db_path
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._image_locks = {}
+        self._manifest = None
+        self._package_index = None
+        self._store = None
+        self._trends = None
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                image TEXT NOT NULL,
+                options TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                stages TEXT NOT NULL DEFAULT '{}',
+                error TEXT,
+                result TEXT
+            )""")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (image, options, status)")
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def start(self):
+        """Requeue jobs interrupted by a restart and start the workers, once"""
+        with self._lock:
+            if self._threads:
+                return
+            with self._connect() as db:
+                db.execute("UPDATE jobs SET status = 'queued', started_at = NULL, stages = '{}' "
+                           "WHERE status = 'running'")
+                pending = [row['id'] for row in db.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at")]
+            for job_id in pending:
+                self._queue.put(job_id)
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, image, options):
+        """Queue a scan and return (job, created); an identical queued or running job is reused"""
+        self.start()
+        encoded_options = json.dumps(options, sort_keys=True)
+        with self._lock, self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE image = ? AND options = ? "
+                             "AND status IN ('queued', 'running')", (image, encoded_options)).fetchone()
+            if row:
+                return self._to_dict(row), False
+            job_id = uuid.uuid4().hex
+            db.execute("INSERT INTO jobs (id, image, options, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                       (job_id, image, encoded_options, datetime.now().isoformat()))
+        self._queue.put(job_id)
+        return self.get(job_id), True
+
+    def get(self, job_id):
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, status=None, limit=50):
+        query = "SELECT * FROM jobs"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._connect() as db:
+            return [self._to_dict(row) for row in db.execute(query, params)]
+
+    def _to_dict(self, row):
+        job = dict(row)
+        job['options'] = json.loads(job['options'])
+        job['stages'] = json.loads(job['stages'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def _update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as db:
+            db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            except Exception as e:
+                self._update(job_id, status='failed', finished_at=datetime.now().isoformat(), error=str(e))
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        job = self.get(job_id)
+        if not job or job['status'] != 'queued':
+            return
+        with self._lock:
+            image_lock = self._image_locks.setdefault(image_slug(job['image']), threading.Lock())
+        # Scans writing to the same directory take turns
+        with image_lock:
+            self._scan(job_id, job)
+
+    def _scan(self, job_id, job):
+        # Jobs queued before image names were validated may still be in the database
+        if not is_valid_image_reference(job['image']):
+            self._update(job_id, status='failed', finished_at=datetime.now().isoformat(),
+                         error='Invalid image reference')
+            return
+        image_dir = os.path.join(SCANS_DIR, image_slug(job['image']))
+        if not claim_image_dir(image_dir, job['image']):
+            self._update(job_id, status='failed', finished_at=datetime.now().isoformat(),
+                         error=f"{image_slug(job['image'])} already holds results of {image_dir_owner(image_dir)}")
+            return
+        stages = {}
+        self._update(job_id, status='running', started_at=datetime.now().isoformat(), stages='{}')
+
+        def progress(stage, state, seconds=None):
+            stages[stage] = {'status': state, 'seconds': seconds}
+            self._update(job_id, stages=json.dumps(stages))
+
+        with self._lock:
+            if self._manifest is None:
+                os.makedirs(SCANS_DIR, exist_ok=True)
+                self._manifest = ScanManifest(os.path.join(SCANS_DIR, 'scan-manifest.json'))
+                self._package_index = PackageIndex(PACKAGE_INDEX_PATH)
+                self._store = ScanStore(SCAN_STORE_PATH) if SCAN_STORE_PATH else None
+                self._trends = TrendStore(TRENDS_PATH)
+        # scan_image only moves the latest links once every artifact is written, so
+        # readers of SCANS_DIR see either the previous scan or the complete new one
+        result = scan_image(job['image'], image_dir, S3_BUCKET,
+                            manifest=self._manifest, progress=progress, package_index=self._package_index,
+                            store=self._store, trends=self._trends, **job['options'])
+        summary = {
+            'ok': result['ok'],
+            'cached': result.get('cached', False),
+            'critical_high': len(result['vulnerabilities']),
+            'scan_file': result.get('scan_file'),
+            'sbom_file': result.get('sbom_file'),
+            'timings': result['timings']
+        }
+        self._update(job_id, status='succeeded' if result['ok'] else 'failed',
+                     finished_at=datetime.now().isoformat(), result=json.dumps(summary),
+                     error=None if result['ok'] else 'Scan failed, see the EC2 server log')
+
+
+scan_jobs = ScanJobQueue(JOBS_DB_PATH, SCAN_WORKERS)
+
+
+def find_packages(name, version=None):
+    """Look up the images shipping a package, optionally at one version, in the package index"""
+    if not os.path.exists(PACKAGE_INDEX_PATH):
+        raise FileNotFoundError("Package index not found")
+    query = "SELECT name, version, type, purl, image, digest, locations FROM packages WHERE name = ?"
+    params = [name]
+    if version is not None:
+        query += " AND version = ?"
+        params.append(version)
+    query += " ORDER BY version, image"
+    db = sqlite3.connect(f"file:{PACKAGE_INDEX_PATH}?mode=ro", uri=True, timeout=30)
+    try:
+        rows = db.execute(query, params).fetchall()
+    finally:
+        db.close()
+    return [{
+        'name': row[0],
+        'version': row[1],
+        'type': row[2],
+        'purl': row[3],
+        'image': row[4],
+        'digest': row[5],
+        'locations': json.loads(row[6])
+    } for row in rows]
+
+
+_scan_store = None
+_scan_store_lock = threading.Lock()
+
+
+def open_scan_store():
+    """Return the shared read-only scan history store.
+
+    Stored objects never change, so its object cache stays valid across requests.
+    """
+    global _scan_store
+    if not SCAN_STORE_PATH or not os.path.exists(SCAN_STORE_PATH):
+        raise FileNotFoundError("Scan history store not found")
+    with _scan_store_lock:
+        if _scan_store is None:
+            _scan_store = ScanStore(SCAN_STORE_PATH, readonly=True)
+        return _scan_store
+
+
+def week_start(scanned_at):
+    day = datetime.fromisoformat(scanned_at[:10])
+    return (day - timedelta(days=day.weekday())).date().isoformat()
+
+
+# Bucket key of a rollup's scanned_at; "scan" keeps every rollup
+TREND_BUCKETS = {
+    'scan': lambda scanned_at: scanned_at,
+    'day': lambda scanned_at: scanned_at[:10],
+    'week': week_start,
+    'month': lambda scanned_at: scanned_at[:7],
+}
+
+
+def parse_time(value, end_of_day=False):
+    """Parse an ISO date or datetime; a bare date as the end of a range covers the whole day"""
+    parsed = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1, seconds=-1)
+    return parsed
+
+
+def query_trends(image=None, start=None, end=None, bucket='day'):
+    """Bucketed rollups of an image, each bucket reporting its last scan and how many ran"""
+    if bucket not in TREND_BUCKETS:
+        raise ValueError(f"bucket must be one of {', '.join(TREND_BUCKETS)}")
+    if not os.path.exists(TRENDS_PATH):
+        raise FileNotFoundError("Trend rollups not found")
+    trends = TrendStore(TRENDS_PATH, readonly=True)
+    images = trends.images()
+    image = image or (images[0] if images else None)
+    if image not in images:
+        raise LookupError(f"No trend data for image {image}")
+    end = parse_time(end, end_of_day=True) if end else datetime.now()
+    start = parse_time(start) if start else end - timedelta(days=90)
+
+    points = OrderedDict()
+    key = TREND_BUCKETS[bucket]
+    for rollup in trends.query(image, start, end):
+        bucket_key = key(rollup['scanned_at'])
+        scans = points[bucket_key]['scans'] + 1 if bucket_key in points else 1
+        # Rollups arrive oldest first, so each bucket ends up holding its latest scan
+        points[bucket_key] = dict(rollup, bucket=bucket_key, scans=scans)
+    return {
+        "image": image,
+        "images": images,
+        "bucket": bucket,
+        "from": start.isoformat(timespec='seconds'),
+        "to": end.isoformat(timespec='seconds'),
+        "points": list(points.values())
+    }
+
+
+class ChangeFeed:
+    """Bounded, sequence-numbered log of published scans that readers can wait on"""
+
+    def __init__(self, size):
+        self._events = deque(maxlen=size)
+        self._seq = 0
+        self._condition = threading.Condition()
+
+    @property
+    def last_seq(self):
+        with self._condition:
+            return self._seq
+
+    def publish(self, event):
+        with self._condition:
+            self._seq += 1
+            self._events.append({'seq': self._seq, **event})
+            self._condition.notify_all()
+
+    def since(self, seq, timeout=0):
+        """Return (events after seq, last seq, reset), waiting up to timeout for one to arrive.
+
+        reset is True when events after seq have already been dropped from the log, or seq
+        is ahead of the log (a cursor from before a restart), in which case the caller should
+        invalidate everything it holds and continue from the returned seq.
+        """
+        with self._condition:
+            if seq is None:
+                seq = self._seq
+            if seq > self._seq:
+                return [], self._seq, True
+            self._condition.wait_for(lambda: self._seq > seq, timeout)
+            reset = bool(self._events) and self._events[0]['seq'] > seq + 1
+            events = [event for event in self._events if event['seq'] > seq]
+            return events, self._seq, reset
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class ScanWatcher:
+    """Reloads published scans as soon as their latest links move and records each change.
+
+    On Linux the working directory, SCANS_DIR and every per-image directory are watched
+    with inotify; elsewhere they are polled every WATCH_POLL_INTERVAL seconds. Either way
+    a trigger only compares file versions, so spurious or batched events are harmless.
+    """
+
+    def __init__(self, feed, poll_interval):
+        self.feed = feed
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._versions = {}
+        self._wds = {}
+
+    def directories(self):
+        """Map each watched directory to the paths request handlers use for its latest files"""
+        names = [SCAN_RESULTS_PATH, SBOM_PATH, CRITICAL_HIGH_VULNS_PATH]
+        directories = {os.path.dirname(SCAN_RESULTS_PATH) or '.': names}
+        if os.path.isdir(SCANS_DIR):
+            for entry in os.scandir(SCANS_DIR):
+                if entry.is_dir():
+                    directories[entry.path] = [os.path.join(entry.path, os.path.basename(name)) for name in names]
+        return directories
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            os.makedirs(SCANS_DIR, exist_ok=True)
+            for directory, paths in self.directories().items():
+                self.check(directory, paths, publish=False)
+            self._thread = threading.Thread(target=self._run, name='scan-watch', daemon=True)
+            self._thread.start()
+
+    def check(self, directory, paths, publish=True):
+        """Reload whichever latest files in directory changed and publish one change event"""
+        scan_path, _, critical_high_path = paths
+        changed = []
+        for path in [*paths, snapshot_path_for(scan_path)]:
+            try:
+                version = get_scan_version(path)
+            except FileNotFoundError:
+                version = None
+            if self._versions.get(path) != version:
+                self._versions[path] = version
+                if version is not None:
+                    changed.append(path)
+        if not changed:
+            return
+
+        image = None
+        try:
+            # Map and rank the new snapshot now so the first request after a publish is fast.
+            # Scans without a snapshot are left to be parsed on first use.
+            snapshot = open_snapshot(scan_path) if os.path.exists(scan_path) else None
+            if snapshot:
+                image = snapshot.metadata.get('image')
+                rank_risks(scan_path)
+            if os.path.exists(critical_high_path):
+                load_json(critical_high_path)
+        except Exception as e:
+            print(f"Error reloading {directory}: {str(e)}")
+
+        if publish:
+            self.feed.publish({
+                'image': image,
+                'directory': directory,
+                'files': [os.path.basename(path) for path in changed],
+                'scan_version': get_scan_version(scan_path) if os.path.exists(scan_path) else None,
+                'time': datetime.now().isoformat()
+            })
+
+    def check_all(self):
+        for directory, paths in self.directories().items():
+            self.check(directory, paths)
+
+    def _run(self):
+        try:
+            self._watch_inotify()
+        except Exception as e:
+            print(f"inotify unavailable ({str(e)}), polling every {self.poll_interval}s")
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.check_all()
+            except Exception as e:
+                print(f"Error checking published scans: {str(e)}")
+
+    def _add_watch(self, libc, fd, directory):
+        wd = libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self._wds[wd] = directory
+
+    def _watch_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        for directory in [SCANS_DIR, *self.directories()]:
+            self._add_watch(libc, fd, directory)
+        # Catch anything published between the initial check and the watches being added
+        self.check_all()
+
+        while True:
+            # A publish moves several links in quick succession, so collect events until
+            # the directory has been quiet briefly and report the whole set as one change
+            buffer = os.read(fd, 64 * 1024)
+            while select.select([fd], [], [], WATCH_SETTLE_INTERVAL)[0]:
+                buffer += os.read(fd, 64 * 1024)
+            touched = set()
+            overflow = False
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+                name = buffer[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0')
+                offset += INOTIFY_EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                directory = self._wds.get(wd)
+                if directory is None:
+                    continue
+                if directory == SCANS_DIR:
+                    if mask & IN_ISDIR:
+                        image_dir = os.path.join(SCANS_DIR, os.fsdecode(name))
+                        self._add_watch(libc, fd, image_dir)
+                        touched.add(image_dir)
+                else:
+                    touched.add(directory)
+
+            directories = self.directories()
+            for directory in directories if overflow else touched:
+                if directory in directories:
+                    self.check(directory, directories[directory])
+
+
+change_feed = ChangeFeed(CHANGE_FEED_SIZE)
+scan_watcher = ScanWatcher(change_feed, WATCH_POLL_INTERVAL)
 
 
 # CORS headers
@@ -48,6 +953,7 @@ def add_cors_headers(response):
 
 
 @app.route('/')
+@admission.limit('health')
 def home():
     return jsonify({
         "status": "ok",
@@ -56,11 +962,22 @@ def home():
 
 
 @app.route('/results', methods=['GET'])
+@admission.limit('results')
 def get_scan_results():
     try:
-        with open(SCAN_RESULTS_PATH, 'r') as f:
-            scan_data = json.load(f)
-        return jsonify(scan_data)
+        severity = request.args.getlist('severity')
+        package = request.args.get('package')
+        fixable = parse_bool(request.args.get('fixable'))
+        fields = request.args.get('fields')
+
+        def build():
+            scan_data = load_json(SCAN_RESULTS_PATH)
+            if severity or package or fixable is not None:
+                scan_data = dict(scan_data, matches=filter_matches(scan_data.get('matches', []),
+                                                                   severity, package, fixable))
+            return project(scan_data, parse_fields(fields))
+
+        return encoded_json_response(SCAN_RESULTS_PATH, ('results', tuple(severity), package, fixable, fields), build)
     except FileNotFoundError:
         return jsonify({"error": "Scan results file not found"}), 404
     except json.JSONDecodeError:
@@ -70,43 +987,10 @@ def get_scan_results():
 
 
 @app.route('/stats', methods=['GET'])
+@admission.limit('stats')
 def get_vulnerability_stats():
     try:
-        with open(SCAN_RESULTS_PATH, 'r') as f:
-            scan_data = json.load(f)
-
-        # Count vulnerabilities by severity
-        severity_counts = {}
-        package_counts = {}
-
-        for match in scan_data.get('matches', []):
-            # Count by severity
-            severity = match.get('vulnerability', {}).get('severity', 'unknown')
-            severity_counts[severity] = severity_counts.get(severity, 0) + 1
-
-            # Count by package
-            package = match.get('artifact', {}).get('name', 'unknown')
-            if package not in package_counts:
-                package_counts[package] = 1
-            else:
-                package_counts[package] += 1
-
-        # Get top 5 vulnerable packages
-        top_packages = sorted(package_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-
-        # Check if there are any fixable vulnerabilities
-        fixable_count = 0
-        for match in scan_data.get('matches', []):
-            if match.get('vulnerability', {}).get('fix', {}).get('state') == 'fixed':
-                fixable_count += 1
-
-        return jsonify({
-            "total_vulnerabilities": len(scan_data.get('matches', [])),
-            "severity_distribution": severity_counts,
-            "top_vulnerable_packages": dict(top_packages),
-            "fixable_vulnerabilities": fixable_count,
-            "scan_timestamp": scan_data.get('timestamp', 'unknown')
-        })
+        return jsonify(query_stats({}))
     except FileNotFoundError:
         return jsonify({"error": "Scan results file not found"}), 404
     except json.JSONDecodeError:
@@ -116,6 +1000,7 @@ def get_vulnerability_stats():
 
 
 @app.route('/sbom', methods=['GET'])
+@admission.limit('sbom')
 def get_sbom():
     try:
         with open(SBOM_PATH, 'r') as f:
@@ -129,28 +1014,42 @@ def get_sbom():
         return jsonify({"error": f"Error reading SBOM: {str(e)}"}), 500
 
 
+def send_published_file(path):
+    """Send the file behind a published symlink with Range and If-Range support.
+
+    The ETag and Last-Modified headers come from the timestamped target, so a resumed
+    download fails over to a full response if a newer scan was published in between.
+    """
+    return send_file(os.path.realpath(path), as_attachment=True, download_name=os.path.basename(path),
+                     conditional=True, etag=True)
+
+
 @app.route('/download/results', methods=['GET'])
+@admission.limit('download')
 def download_scan_results():
     try:
-        return send_file(SCAN_RESULTS_PATH, as_attachment=True)
+        return send_published_file(SCAN_RESULTS_PATH)
     except Exception as e:
         return jsonify({"error": f"Error downloading scan results: {str(e)}"}), 500
 
 
 @app.route('/download/sbom', methods=['GET'])
+@admission.limit('download')
 def download_sbom():
     try:
-        return send_file(SBOM_PATH, as_attachment=True)
+        return send_published_file(SBOM_PATH)
     except Exception as e:
         return jsonify({"error": f"Error downloading SBOM: {str(e)}"}), 500
 
 
 @app.route('/critical-high', methods=['GET'])
+@admission.limit('critical-high')
 def get_critical_high_vulnerabilities():
     try:
-        with open(CRITICAL_HIGH_VULNS_PATH, 'r') as f:
-            data = json.load(f)
-        return jsonify(data)
+        fields = request.args.get('fields')
+        return encoded_json_response(
+            CRITICAL_HIGH_VULNS_PATH, ('critical-high', fields),
+            lambda: project(load_json(CRITICAL_HIGH_VULNS_PATH), parse_fields(fields)))
     except FileNotFoundError:
         return jsonify({"error": "Critical/high vulnerabilities file not found"}), 404
     except json.JSONDecodeError:
@@ -159,6 +1058,410 @@ def get_critical_high_vulnerabilities():
         return jsonify({"error": f"Error reading critical/high vulnerabilities: {str(e)}"}), 500
 
 
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def iter_export_matches(scan_path, severity=None):
+    """Stream the matches of a scan file, filtered as they are parsed"""
+    accept = match_filter(severity)
+    with open(scan_path, 'r') as f:
+        try:
+            yield from filter(accept, iter_grype_matches(f))
+        except ValueError as e:
+            # Headers are already sent, so a broken scan can only end the export early
+            print(f"Error parsing {scan_path} during export: {str(e)}")
+
+
+def generate_export(matches, export_format):
+    """Yield the export one row at a time so memory stays bounded by a single row"""
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=VULNERABILITY_FIELDS)
+        writer.writeheader()
+        for match in matches:
+            writer.writerow(vulnerability_row(match))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for match in matches:
+            yield json.dumps(vulnerability_row(match)) + '\n'
+
+
+@app.route('/export', methods=['GET'])
+@admission.limit('export')
+def export_scan_results():
+    """Stream scan results as CSV or NDJSON, optionally filtered by severity"""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported export format: {export_format}"}), 400
+    try:
+        # Resolve the link now so the whole export comes from the scan published at request time
+        scan_path = os.path.realpath(SCAN_RESULTS_PATH)
+        if not os.path.isfile(scan_path):
+            raise FileNotFoundError(scan_path)
+        matches = iter_export_matches(scan_path, request.args.getlist('severity'))
+        filename = f"vulnerability_scan.{export_format}"
+        return Response(generate_export(matches, export_format), mimetype=EXPORT_FORMATS[export_format],
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+    except FileNotFoundError:
+        return jsonify({"error": "Scan results file not found"}), 404
+    except Exception as e:
+        return jsonify({"error": f"Error exporting scan results: {str(e)}"}), 500
+
+
+def query_stats(query):
+    scan_path, _, _ = resolve_scan_paths(query.get('image'))
+    snapshot = open_snapshot(scan_path)
+    if snapshot:
+        stats = snapshot.stats()
+    else:
+        stats = compute_vulnerability_stats(load_json(scan_path))
+    stats["scan_version"] = get_scan_version(scan_path)
+    return stats
+
+
+def query_vulnerabilities(query):
+    """Page through flattened vulnerability rows, served from the snapshot when available.
+
+    Rows have the snapshot's shape whichever source answers, so they carry no description.
+    """
+    scan_path, _, _ = resolve_scan_paths(query.get('image'))
+    severity = query.get('severity')
+    if isinstance(severity, str):
+        severity = [severity]
+    page = max(int(query.get('page', 1)), 1)
+    per_page = min(max(int(query.get('per_page', 50)), 1), 1000)
+    start = (page - 1) * per_page
+    fixable = parse_bool(query.get('fixable'))
+
+    snapshot = open_snapshot(scan_path)
+    if snapshot:
+        indexes = snapshot.filter(severity, query.get('package'), fixable)
+        total = len(indexes)
+        rows = [snapshot.row(index) for index in indexes[start:start + per_page]]
+    else:
+        matches = filter_matches(load_json(scan_path).get('matches', []), severity, query.get('package'), fixable)
+        total = len(matches)
+        rows = [snapshot_row(match) for match in matches[start:start + per_page]]
+
+    return {
+        "page": page,
+        "per_page": per_page,
+        "total": total,
+        "vulnerabilities": project(rows, parse_fields(query.get('fields')))
+    }
+
+
+def query_critical_high(query):
+    _, _, critical_high_path = resolve_scan_paths(query.get('image'))
+    return project(load_json(critical_high_path), parse_fields(query.get('fields')))
+
+
+def query_results(query):
+    scan_path, _, _ = resolve_scan_paths(query.get('image'))
+    scan_data = load_json(scan_path)
+    severity = query.get('severity')
+    if isinstance(severity, str):
+        severity = [severity]
+    matches = filter_matches(scan_data.get('matches', []), severity, query.get('package'),
+                             parse_bool(query.get('fixable')))
+    return project(dict(scan_data, matches=matches), parse_fields(query.get('fields')))
+
+
+def query_top_risks(query):
+    """The n highest-risk matches of a scan, ranked by the composite risk score"""
+    scan_path, _, _ = resolve_scan_paths(query.get('image'))
+    n = min(max(int(query.get('n', 10)), 1), TOP_RISKS_MAX)
+    return {
+        "scan_version": get_scan_version(scan_path),
+        "weights": RISK_WEIGHTS,
+        "n": n,
+        "risks": project(rank_risks(scan_path)[:n], parse_fields(query.get('fields')))
+    }
+
+
+BATCH_QUERY_HANDLERS = {
+    'stats': query_stats,
+    'vulnerabilities': query_vulnerabilities,
+    'critical-high': query_critical_high,
+    'results': query_results,
+    'top-risks': query_top_risks,
+}
+
+
+@app.route('/vulnerabilities', methods=['GET'])
+@admission.limit('vulnerabilities')
+def get_vulnerabilities():
+    """Filtered, paginated vulnerability rows answered from the columnar snapshot"""
+    try:
+        query = request.args.to_dict()
+        query['severity'] = request.args.getlist('severity')
+        return jsonify(query_vulnerabilities(query))
+    except (FileNotFoundError, LookupError) as e:
+        return jsonify({"error": str(e)}), 404
+    except json.JSONDecodeError:
+        return jsonify({"error": "Invalid JSON in scan results file"}), 500
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error reading vulnerabilities: {str(e)}"}), 500
+
+
+@app.route('/top-risks', methods=['GET'])
+@admission.limit('top-risks')
+def get_top_risks():
+    """Matches ranked by EPSS percentile, CVSS base score and fix availability"""
+    try:
+        query = request.args.to_dict()
+        scan_path, _, _ = resolve_scan_paths(query.get('image'))
+        return encoded_json_response(scan_path, ('top-risks', query.get('n'), query.get('fields')),
+                                     lambda: query_top_risks(query))
+    except (FileNotFoundError, LookupError) as e:
+        return jsonify({"error": str(e)}), 404
+    except json.JSONDecodeError:
+        return jsonify({"error": "Invalid JSON in scan results file"}), 500
+    except ValueError:
+        return jsonify({"error": "n must be an integer"}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error ranking vulnerabilities: {str(e)}"}), 500
+
+
+@app.route('/batch', methods=['POST'])
+@admission.limit('batch')
+def run_batch():
+    """Run several stats, vulnerabilities, critical-high and results queries in one request.
+
+    Each query is a JSON object with a "type" and optional "id", "image", "severity",
+    "package", "fixable" and "fields" keys. Scans are parsed once and shared between queries.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('queries'), list):
+        return jsonify({"error": "Request body must be a JSON object with a list of queries"}), 400
+
+    results = []
+    for index, query in enumerate(body['queries']):
+        if not isinstance(query, dict):
+            results.append({"id": index, "status": 400, "error": "Query must be a JSON object"})
+            continue
+        query_id = query.get('id', index)
+        handler = BATCH_QUERY_HANDLERS.get(query.get('type'))
+        if handler is None:
+            results.append({"id": query_id, "status": 400,
+                            "error": f"Unknown query type: {query.get('type')}"})
+            continue
+        try:
+            results.append({"id": query_id, "status": 200, "data": handler(query)})
+        except (FileNotFoundError, LookupError) as e:
+            results.append({"id": query_id, "status": 404, "error": str(e)})
+        except json.JSONDecodeError:
+            results.append({"id": query_id, "status": 500, "error": "Invalid JSON in scan file"})
+        except Exception as e:
+            results.append({"id": query_id, "status": 500, "error": f"Error running query: {str(e)}"})
+
+    return jsonify({"results": results})
+
+
+@app.route('/scans', methods=['POST'])
+@admission.limit('scans')
+def submit_scan():
+    """Queue a scan of {"image": ..., "sbom_first": ..., "force": ..., "compress": ...}"""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('image'), str) or not body['image'].strip():
+        return jsonify({"error": "Request body must be a JSON object with an image"}), 400
+    if not is_valid_image_reference(body['image'].strip()):
+        return jsonify({"error": "image must be a Docker image reference such as alpine:3.19"}), 400
+
+    options = {name: bool(body[name]) for name in ScanJobQueue.OPTIONS if name in body}
+    try:
+        job, created = scan_jobs.submit(body['image'].strip(), options)
+    except Exception as e:
+        return jsonify({"error": f"Error queueing scan: {str(e)}"}), 500
+    response = jsonify(job)
+    response.headers['Location'] = f"/scans/{job['id']}"
+    return response, 202 if created else 200
+
+
+@app.route('/scans/<job_id>', methods=['GET'])
+@admission.limit('scans')
+def get_scan_job(job_id):
+    """Status, per-stage progress and result of a scan job"""
+    try:
+        job = scan_jobs.get(job_id)
+    except Exception as e:
+        return jsonify({"error": f"Error reading scan job: {str(e)}"}), 500
+    if job is None:
+        return jsonify({"error": f"Scan job not found: {job_id}"}), 404
+    return jsonify(job)
+
+
+@app.route('/scans', methods=['GET'])
+@admission.limit('scans')
+def list_scan_jobs():
+    """Most recent scan jobs, optionally filtered by ?status="""
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    try:
+        jobs = scan_jobs.list(request.args.get('status'), limit)
+    except Exception as e:
+        return jsonify({"error": f"Error listing scan jobs: {str(e)}"}), 500
+    return jsonify({"jobs": jobs})
+
+
+@app.route('/changes', methods=['GET'])
+@admission.limit('changes')
+def get_changes():
+    """Feed of newly published scans, as a long poll or, with Accept: text/event-stream, as SSE.
+
+    Long polls return the events after ?since=<seq> (default: the current position), waiting
+    up to ?timeout= seconds for one to arrive. SSE clients resume from Last-Event-ID.
+    """
+    scan_watcher.start()
+    try:
+        since = request.headers.get('Last-Event-ID', request.args.get('since'))
+        since = int(since) if since not in (None, '') else None
+        timeout = min(float(request.args.get('timeout', 25)), CHANGES_MAX_TIMEOUT)
+    except ValueError:
+        return jsonify({"error": "since and timeout must be numbers"}), 400
+
+    if 'text/event-stream' not in request.headers.get('Accept', ''):
+        events, last_seq, reset = change_feed.since(since, max(timeout, 0))
+        return jsonify({"events": events, "last_seq": last_seq, "reset": reset})
+
+    def generate():
+        seq = since
+        yield "retry: 2000\n\n"
+        while True:
+            events, last_seq, reset = change_feed.since(seq, 15)
+            if reset:
+                yield f"event: reset\nid: {last_seq}\ndata: {{}}\n\n"
+            for event in events:
+                yield f"id: {event['seq']}\ndata: {json.dumps(event)}\n\n"
+            if not events and not reset:
+                yield ": keepalive\n\n"
+            seq = last_seq
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/packages', methods=['GET'])
+@app.route('/packages/<name>', methods=['GET'])
+@app.route('/packages/<name>/<version>', methods=['GET'])
+@admission.limit('packages')
+def get_package_images(name=None, version=None):
+    """Images shipping a package, answered from the package index without reading SBOMs.
+
+    Names containing a slash (Go modules, scoped npm packages) can be passed as ?name=,
+    together with an optional ?version=.
+    """
+    name = name or request.args.get('name')
+    version = version or request.args.get('version')
+    if not name:
+        return jsonify({"error": "A package name is required"}), 400
+    try:
+        packages = find_packages(name, version)
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": f"Error reading package index: {str(e)}"}), 500
+    return jsonify({
+        "name": name,
+        "version": version,
+        "images": sorted({package['image'] for package in packages}),
+        "packages": packages
+    })
+
+
+@app.route('/history', methods=['GET'])
+@admission.limit('history')
+def list_scan_history():
+    """Scans kept in the deduplicated history store, newest first, with store totals"""
+    try:
+        store = open_scan_store()
+        return jsonify({"scans": store.scans(request.args.get('image')), "store": store.stats()})
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": f"Error reading scan history: {str(e)}"}), 500
+
+
+@app.route('/history/<int:scan_id>', methods=['GET'])
+@app.route('/history/<int:scan_id>/sbom', methods=['GET'], defaults={'kind': 'sbom'})
+@admission.limit('history')
+def get_stored_document(scan_id, kind='scan'):
+    """Rebuild a stored scan or SBOM, streamed as its objects are read from the store"""
+    try:
+        document = open_scan_store().iter_document(scan_id, kind)
+        # Resolve the manifest now so an unknown id is a 404 rather than a broken stream
+        first = next(document)
+    except (FileNotFoundError, LookupError) as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": f"Error reading scan history: {str(e)}"}), 500
+
+    def generate():
+        yield first
+        yield from document
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+@app.route('/history/<int:scan_id>/vulnerabilities', methods=['GET'])
+@admission.limit('history')
+def get_stored_vulnerabilities(scan_id):
+    """Filtered, paginated vulnerability rows of a stored scan, decoding only the records needed"""
+    try:
+        severity = request.args.getlist('severity')
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 50)), 1), 1000)
+        start = (page - 1) * per_page
+        matches = open_scan_store().iter_matches(scan_id, keys={'vulnerability', 'artifact', 'relatedVulnerabilities'})
+        matches = filter_matches(matches, severity, request.args.get('package'),
+                                 parse_bool(request.args.get('fixable')))
+        return jsonify({
+            "page": page,
+            "per_page": per_page,
+            "total": len(matches),
+            "vulnerabilities": project([snapshot_row(match) for match in matches[start:start + per_page]],
+                                       parse_fields(request.args.get('fields')))
+        })
+    except ValueError:
+        return jsonify({"error": "page and per_page must be integers"}), 400
+    except (FileNotFoundError, LookupError) as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": f"Error reading scan history: {str(e)}"}), 500
+
+
+@app.route('/trends', methods=['GET'])
+@admission.limit('trends')
+def get_trends():
+    """Severity, fixable and top-package trends of an image from the per-scan rollups"""
+    try:
+        return jsonify(query_trends(request.args.get('image'), request.args.get('from'), request.args.get('to'),
+                                    request.args.get('bucket', 'day')))
+    except (FileNotFoundError, LookupError) as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": f"Invalid trend query: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error reading trends: {str(e)}"}), 500
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics for admission control"""
+    return Response(admission.metrics(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', PORT))
+    scan_jobs.start()
+    scan_watcher.start()
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
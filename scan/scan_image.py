@@ -3,48 +3,669 @@ import subprocess
 import json
 import csv
 import os
+import re
+import gzip
+import fcntl
+import zlib
+import math
+import mmap
+import time
+import array
+import codecs
+import struct
+import shutil
+import tarfile
+import sqlite3
+import tempfile
+import hashlib
 import argparse
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
 
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
 
-def run_command(command):
-    """Run a shell command and return the output"""
+# Command names can be overridden, e.g. to substitute stub binaries in tests
+DOCKER_BIN = os.environ.get('DOCKER_BIN', 'docker')
+GRYPE_BIN = os.environ.get('GRYPE_BIN', 'grype')
+SYFT_BIN = os.environ.get('SYFT_BIN', 'syft')
+AWS_BIN = os.environ.get('AWS_BIN', 'aws')
+
+
+def run_command(command, output_file=None):
+    """Run a command given as an argument list, without a shell, and return the output.
+
+    When output_file is given, stdout is written to it instead and an empty string is returned.
+    """
     try:
-        result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
+        if output_file:
+            with open(output_file, 'w') as f:
+                subprocess.run(command, check=True, stdout=f, stderr=subprocess.PIPE, text=True)
+            return ''
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
         return result.stdout
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing command: {command}")
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"Error executing command: {' '.join(command)}")
         print(f"Error: {e}")
-        print(f"STDERR: {e.stderr}")
+        if getattr(e, 'stderr', None):
+            print(f"STDERR: {e.stderr}")
+        # Don't leave a partial output behind for callers that check whether the file exists
+        if output_file and os.path.exists(output_file):
+            os.unlink(output_file)
         return None
 
 
+# Docker image reference: [registry[:port]/]path[:tag][@digest], as accepted by docker pull
+IMAGE_REFERENCE = re.compile(
+    r'(?:(?:[a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9-]*[a-zA-Z0-9])'
+    r'(?:\.(?:[a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9-]*[a-zA-Z0-9]))*(?::[0-9]+)?/)?'
+    r'[a-z0-9]+(?:(?:[._]|__|-+)[a-z0-9]+)*'
+    r'(?:/[a-z0-9]+(?:(?:[._]|__|-+)[a-z0-9]+)*)*'
+    r'(?::[a-zA-Z0-9_][a-zA-Z0-9_.-]{0,127})?'
+    r'(?:@[a-zA-Z][a-zA-Z0-9]*(?:[-_+.][a-zA-Z][a-zA-Z0-9]*)*:[0-9a-fA-F]{32,})?'
+)
+
+
+def is_valid_image_reference(image_name):
+    """Return True if image_name is a well-formed Docker image reference"""
+    return isinstance(image_name, str) and len(image_name) <= 512 and bool(IMAGE_REFERENCE.fullmatch(image_name))
+
+
 def pull_docker_image(image_name):
     """Pull a Docker image from a public registry"""
     print(f"Pulling Docker image: {image_name}")
-    return run_command(f"docker pull {image_name}")
+    return run_command([DOCKER_BIN, 'pull', image_name])
 
 
-def scan_with_grype(image_name, output_file="vulnerability_scan.json"):
-    """Scan the Docker image with Grype and save results to a JSON file"""
-    print(f"Scanning image with Grype: {image_name}")
-    result = run_command(f"grype {image_name} -o json > {output_file}")
-    if not result:
-        # Grype outputs directly to file, so we don't use the result
-        # Just check if the file exists
-        if os.path.exists(output_file):
-            print(f"Scan complete. Results saved to {output_file}")
-            return output_file
-        else:
-            print("Error: Scan results file not found")
+def resolve_remote_digest(image_name):
+    """Resolve the registry manifest digest of an image without pulling it"""
+    output = run_command([DOCKER_BIN, 'buildx', 'imagetools', 'inspect', '--format', '{{json .Manifest}}', image_name])
+    if not output:
+        return None
+    try:
+        return json.loads(output).get('digest')
+    except json.JSONDecodeError:
+        return None
+
+
+def get_grype_db_version():
+    """Return an identifier for the installed Grype vulnerability database"""
+    output = run_command([GRYPE_BIN, 'db', 'status', '-o', 'json'])
+    if not output:
+        return None
+    try:
+        status = json.loads(output)
+        return f"{status.get('schemaVersion')}:{status.get('built')}"
+    except json.JSONDecodeError:
+        # Older Grype releases only print a text status
+        return output.strip()
+
+
+class ScanManifest:
+    """Local record of the artifacts produced for each image digest and Grype DB version.
+
+    The CLI and the EC2 server's job queue can share one manifest, so every read goes back
+    to the file and record() re-reads and merges under an exclusive file lock rather than
+    overwriting the file with this process's view of it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self, exclusive):
+        with self._lock, open(f"{self.path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def lookup(self, image_name, digest, db_version):
+        """Return the cached artifacts if the image digest and DB version are unchanged"""
+        if not digest or not db_version:
             return None
-    return output_file
+        with self._locked(exclusive=False):
+            entry = self._load().get(image_name)
+        if not entry or entry.get('digest') != digest or entry.get('db_version') != db_version:
+            return None
+        if not all(os.path.exists(path) for path in entry['artifacts'].values()):
+            return None
+        return entry['artifacts']
+
+    def entries(self):
+        """Return every image's entry"""
+        with self._locked(exclusive=False):
+            return self._load()
+
+    def record(self, image_name, digest, db_version, artifacts):
+        with self._locked(exclusive=True):
+            entries = self._load()
+            entries[image_name] = {
+                'digest': digest,
+                'db_version': db_version,
+                'scanned_at': datetime.now().isoformat(),
+                'artifacts': artifacts
+            }
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+class PackageIndex:
+    """SQLite inverted index from package name and version to the images that ship it.
+
+    Each image's rows are replaced as a whole from its latest SBOM, so the index is built
+    up one image at a time and an SBOM that was already indexed is skipped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS packages (
+                name TEXT NOT NULL,
+                version TEXT,
+                type TEXT,
+                purl TEXT,
+                image TEXT NOT NULL,
+                digest TEXT,
+                locations TEXT NOT NULL
+            )""")
+            db.execute("CREATE INDEX IF NOT EXISTS packages_name_version ON packages (name, version)")
+            db.execute("CREATE INDEX IF NOT EXISTS packages_image ON packages (image)")
+            db.execute("""CREATE TABLE IF NOT EXISTS images (
+                image TEXT PRIMARY KEY,
+                digest TEXT,
+                sbom TEXT NOT NULL,
+                packages INTEGER NOT NULL,
+                indexed_at TEXT NOT NULL
+            )""")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def update(self, image_name, sbom_file, digest=None):
+        """Index the packages of image_name from its SBOM, replacing what was indexed before"""
+        with self._lock, self._connect() as db:
+            row = db.execute("SELECT sbom, digest FROM images WHERE image = ?", (image_name,)).fetchone()
+            if row and row[0] == sbom_file and (digest is None or row[1] == digest):
+                return 0
+
+            source = {}
+            packages = []
+            with open(sbom_file, 'r') as f:
+                for package in iter_sbom_packages(f, source):
+                    if package.get('name'):
+                        locations = [location.get('path') for location in package.get('locations', [])
+                                     if location.get('path')]
+                        packages.append((package['name'], package.get('version'), package.get('type'),
+                                         package.get('purl'), json.dumps(locations)))
+            if digest is None:
+                # Without a registry digest, fall back to the identifiers Syft recorded
+                metadata = source.get('source', {}).get('metadata') or {}
+                digest = metadata.get('manifestDigest') or metadata.get('imageID')
+
+            db.execute("DELETE FROM packages WHERE image = ?", (image_name,))
+            db.executemany("INSERT INTO packages (name, version, type, purl, locations, image, digest) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           [(*package, image_name, digest) for package in packages])
+            db.execute("INSERT OR REPLACE INTO images (image, digest, sbom, packages, indexed_at) "
+                       "VALUES (?, ?, ?, ?, ?)",
+                       (image_name, digest, sbom_file, len(packages), datetime.now().isoformat()))
+        print(f"Indexed {len(packages)} packages for {image_name}")
+        return len(packages)
+
+
+def iter_sbom_packages(stream, metadata=None):
+    """Yield the packages (artifacts) of a Syft JSON document one at a time.
+
+    Other top-level fields are stored in metadata if given.
+    """
+    reader = JsonStreamReader(stream)
+    for key, value_reader in reader.iter_object():
+        if key == 'artifacts':
+            yield from value_reader.iter_array()
+        elif metadata is not None:
+            metadata[key] = value_reader.decode()
+        else:
+            value_reader.decode()
+
+
+TIMESTAMPED_ARTIFACT = re.compile(r'^(vulnerability_scan|sbom|critical_high_vulns|scan_stats)_(\d{8}_\d{6})\.')
+
+
+def scan_time(scan_file):
+    """When a scan ran, from the timestamp in its file name or else its modification time"""
+    match = TIMESTAMPED_ARTIFACT.match(os.path.basename(scan_file))
+    if match:
+        return datetime.strptime(match.group(2), "%Y%m%d_%H%M%S")
+    return datetime.fromtimestamp(os.path.getmtime(scan_file))
+
+
+class ScanStore:
+    """Content-addressed, deduplicated store of scan history.
+
+    Each field of a Grype match (vulnerability, artifact, match details, ...) and each SBOM
+    package is stored once per distinct content, keyed by its SHA-256 and compressed with
+    zlib. A stored scan is a compressed manifest of object ids, so records shared between
+    runs and between images with common base layers are only kept once. Documents are
+    rebuilt, or their matches read, a chunk of objects at a time.
+    """
+
+    CHUNK_SIZE = 256
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_size = 8192
+        if not readonly:
+            with self._connect() as db:
+                db.execute("""CREATE TABLE IF NOT EXISTS objects (
+                    id INTEGER PRIMARY KEY,
+                    hash BLOB NOT NULL UNIQUE,
+                    data BLOB NOT NULL,
+                    size INTEGER NOT NULL
+                )""")
+                db.execute("""CREATE TABLE IF NOT EXISTS scans (
+                    id INTEGER PRIMARY KEY,
+                    image TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    scanned_at TEXT NOT NULL,
+                    matches INTEGER NOT NULL,
+                    raw_size INTEGER NOT NULL,
+                    scan_manifest BLOB NOT NULL,
+                    sbom_manifest BLOB,
+                    UNIQUE (image, name)
+                )""")
+
+    def _connect(self):
+        if self.readonly:
+            return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _put(self, db, value):
+        """Store one JSON value and return its object id"""
+        encoded = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(encoded).digest()
+        row = db.execute("SELECT id FROM objects WHERE hash = ?", (digest,)).fetchone()
+        if row:
+            return row[0]
+        return db.execute("INSERT INTO objects (hash, data, size) VALUES (?, ?, ?)",
+                          (digest, zlib.compress(encoded), len(encoded))).lastrowid
+
+    def _put_document(self, db, path, list_key, iterate, split_items):
+        """Store a document as a manifest: its list items by reference, then its other fields"""
+        metadata = {}
+        items = []
+        with open(path, 'r') as f:
+            for item in iterate(f, metadata):
+                if split_items:
+                    items.append([[key, self._put(db, value)] for key, value in item.items()])
+                else:
+                    items.append(self._put(db, item))
+        fields = [[key, self._put(db, value)] for key, value in metadata.items()]
+        manifest = {'list': list_key, 'split': split_items, 'items': items, 'fields': fields}
+        return zlib.compress(json.dumps(manifest, separators=(',', ':')).encode('utf-8')), len(items)
+
+    def add(self, image_name, scan_file, sbom_file=None):
+        """Store a scan and its SBOM, returning the scan id; a scan already stored is skipped"""
+        name = os.path.basename(scan_file)
+        with self._lock, self._connect() as db:
+            row = db.execute("SELECT id FROM scans WHERE image = ? AND name = ?", (image_name, name)).fetchone()
+            if row:
+                return row[0]
+            scan_manifest, matches = self._put_document(db, scan_file, 'matches', iter_grype_matches, True)
+            sbom_manifest = None
+            raw_size = os.path.getsize(scan_file)
+            if sbom_file and os.path.exists(sbom_file):
+                sbom_manifest, _ = self._put_document(db, sbom_file, 'artifacts', iter_sbom_packages, False)
+                raw_size += os.path.getsize(sbom_file)
+            scanned_at = scan_time(scan_file).isoformat()
+            return db.execute("INSERT INTO scans (image, name, scanned_at, matches, raw_size, scan_manifest, "
+                              "sbom_manifest) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (image_name, name, scanned_at, matches, raw_size, scan_manifest,
+                               sbom_manifest)).lastrowid
+
+    def scans(self, image=None):
+        """List stored scans, newest first"""
+        query = "SELECT id, image, name, scanned_at, matches, raw_size, sbom_manifest IS NOT NULL FROM scans"
+        params = []
+        if image:
+            query += " WHERE image = ?"
+            params.append(image)
+        query += " ORDER BY scanned_at DESC, id DESC"
+        db = self._connect()
+        try:
+            rows = db.execute(query, params).fetchall()
+        finally:
+            db.close()
+        return [{'id': row[0], 'image': row[1], 'name': row[2], 'scanned_at': row[3], 'matches': row[4],
+                 'raw_size': row[5], 'has_sbom': bool(row[6])} for row in rows]
+
+    def stats(self):
+        """Object count, bytes of the raw files stored and bytes actually held by the store"""
+        db = self._connect()
+        try:
+            scans, raw_size = db.execute("SELECT COUNT(*), COALESCE(SUM(raw_size), 0) FROM scans").fetchone()
+            objects, = db.execute("SELECT COUNT(*) FROM objects").fetchone()
+            page_count, = db.execute("PRAGMA page_count").fetchone()
+            page_size, = db.execute("PRAGMA page_size").fetchone()
+        finally:
+            db.close()
+        return {'scans': scans, 'objects': objects, 'raw_size': raw_size, 'stored_size': page_count * page_size}
+
+    def _manifest(self, db, scan_id, kind):
+        column = 'scan_manifest' if kind == 'scan' else 'sbom_manifest'
+        row = db.execute(f"SELECT {column} FROM scans WHERE id = ?", (scan_id,)).fetchone()
+        if row is None or row[0] is None:
+            raise LookupError(f"No stored {kind} with id {scan_id}")
+        return json.loads(zlib.decompress(row[0]))
+
+    def _texts(self, db, ids):
+        """Return {object id: JSON text}, reading missing objects in one query"""
+        texts = {}
+        with self._lock:
+            for object_id in ids:
+                text = self._cache.get(object_id)
+                if text is not None:
+                    self._cache.move_to_end(object_id)
+                    texts[object_id] = text
+        missing = [object_id for object_id in ids if object_id not in texts]
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            rows = db.execute(f"SELECT id, data FROM objects WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            for object_id, data in rows:
+                texts[object_id] = zlib.decompress(data).decode('utf-8')
+        with self._lock:
+            for object_id in missing:
+                self._cache[object_id] = texts[object_id]
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return texts
+
+    def _iter_item_texts(self, db, manifest, keys=None):
+        """Yield the JSON text of each list item, keeping only the given fields of split items"""
+        items = manifest['items']
+        for start in range(0, len(items), self.CHUNK_SIZE):
+            chunk = items[start:start + self.CHUNK_SIZE]
+            if manifest['split']:
+                chunk = [[(key, ref) for key, ref in item if keys is None or key in keys] for item in chunk]
+                texts = self._texts(db, {ref for item in chunk for _, ref in item})
+                for item in chunk:
+                    yield '{' + ','.join(f"{json.dumps(key)}:{texts[ref]}" for key, ref in item) + '}'
+            else:
+                texts = self._texts(db, set(chunk))
+                for ref in chunk:
+                    yield texts[ref]
+
+    def iter_document(self, scan_id, kind='scan'):
+        """Yield the JSON text of a stored scan or SBOM in pieces"""
+        db = self._connect()
+        try:
+            manifest = self._manifest(db, scan_id, kind)
+            yield '{' + json.dumps(manifest['list']) + ':['
+            for index, text in enumerate(self._iter_item_texts(db, manifest)):
+                yield text if index == 0 else ',' + text
+            yield ']'
+            texts = self._texts(db, {ref for _, ref in manifest['fields']})
+            for key, ref in manifest['fields']:
+                yield f",{json.dumps(key)}:{texts[ref]}"
+            yield '}'
+        finally:
+            db.close()
+
+    def iter_matches(self, scan_id, keys=None):
+        """Yield the matches of a stored scan, decoding only the given fields if keys is set"""
+        db = self._connect()
+        try:
+            manifest = self._manifest(db, scan_id, 'scan')
+            for text in self._iter_item_texts(db, manifest, keys):
+                yield json.loads(text)
+        finally:
+            db.close()
+
+
+def scanned_image(scan_file):
+    """Return the image a scan file was run against, or None if it cannot be told.
+
+    The snapshot written next to the scan holds the image in its header; without one the
+    scan is streamed once to reach its source block.
+    """
+    try:
+        with open(os.path.splitext(scan_file)[0] + '.snap', 'rb') as f:
+            magic, _, _, meta_length = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+            if magic == SNAPSHOT_MAGIC:
+                return json.loads(f.read(meta_length)).get('image')
+    except (OSError, struct.error, ValueError):
+        pass
+    metadata = {}
+    try:
+        with open(scan_file, 'r') as f:
+            for _ in iter_grype_matches(f, metadata):
+                pass
+    except (OSError, ValueError):
+        return None
+    target = metadata.get('source', {}).get('target') if isinstance(metadata.get('source'), dict) else None
+    return target.get('userInput') if isinstance(target, dict) else None
+
+
+def image_runs(output_dir, image_name):
+    """Group the unlinked timestamped artifacts in output_dir that belong to image_name by run.
+
+    Several images can share one directory in single-image mode, so a run only counts when
+    it has the scan and critical/high report scan_image writes and the scan was run against
+    image_name. Lone files and runs of other images are left out.
+    """
+    runs = {}
+    for name in os.listdir(output_dir):
+        match = TIMESTAMPED_ARTIFACT.match(name)
+        path = os.path.join(output_dir, name)
+        if match and not os.path.islink(path):
+            runs.setdefault(match.group(2), []).append(path)
+    owned = {}
+    for timestamp, paths in runs.items():
+        scan_file = os.path.join(output_dir, f"vulnerability_scan_{timestamp}.json")
+        report = os.path.join(output_dir, f"critical_high_vulns_{timestamp}.json")
+        if scan_file in paths and report in paths and scanned_image(scan_file) == image_name:
+            owned[timestamp] = paths
+    return owned
+
+
+def prune_stored_files(output_dir, image_name, store):
+    """Delete timestamped artifacts that are no longer published once their scan is stored.
+
+    The files behind the latest links stay on disk; older scans of image_name are added to
+    the store (with the SBOM from the same run, if any) before they and their derived reports
+    are removed. An SBOM still published alongside a re-matched scan is never removed, and
+    files of other images or of runs without a scan are left alone.
+    """
+    published = {os.path.realpath(os.path.join(output_dir, name)) for name in os.listdir(output_dir)
+                 if os.path.islink(os.path.join(output_dir, name))}
+    for timestamp, paths in sorted(image_runs(output_dir, image_name).items()):
+        paths = [path for path in paths if os.path.realpath(path) not in published]
+        scan_file = os.path.join(output_dir, f"vulnerability_scan_{timestamp}.json")
+        if scan_file not in paths:
+            continue
+        store.add(image_name, scan_file, os.path.join(output_dir, f"sbom_{timestamp}.json"))
+        for path in paths:
+            os.remove(path)
+
+
+class TrendStore:
+    """Compact time series with one rollup row per scan.
+
+    Each row holds the counts by severity, the fixable count and the top packages, so
+    trends are answered without opening any scan.
+    """
+
+    SEVERITIES = ['Critical', 'High', 'Medium', 'Low', 'Negligible', 'Unknown']
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        if not readonly:
+            with self._connect() as db:
+                db.execute(f"""CREATE TABLE IF NOT EXISTS rollups (
+                    image TEXT NOT NULL,
+                    scan TEXT NOT NULL,
+                    scanned_at TEXT NOT NULL,
+                    {', '.join(f'{severity.lower()} INTEGER NOT NULL' for severity in self.SEVERITIES)},
+                    total INTEGER NOT NULL,
+                    fixable INTEGER NOT NULL,
+                    top_packages TEXT NOT NULL,
+                    PRIMARY KEY (image, scan)
+                )""")
+                db.execute("CREATE INDEX IF NOT EXISTS rollups_image_time ON rollups (image, scanned_at)")
+
+    def _connect(self):
+        if self.readonly:
+            return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+        return sqlite3.connect(self.path, timeout=30)
+
+    def has(self, image_name, scan_name):
+        with self._connect() as db:
+            return db.execute("SELECT 1 FROM rollups WHERE image = ? AND scan = ?",
+                              (image_name, scan_name)).fetchone() is not None
+
+    def append(self, image_name, scan_name, scanned_at, stats):
+        """Record the rollup of one scan from its statistics; a scan is only recorded once"""
+        severities = {severity.capitalize(): 0 for severity in self.SEVERITIES}
+        for severity, count in stats.get('severity_distribution', {}).items():
+            key = severity.capitalize() if severity.capitalize() in severities else 'Unknown'
+            severities[key] += count
+        with self._connect() as db:
+            db.execute(f"INSERT OR IGNORE INTO rollups VALUES ({', '.join('?' * (len(self.SEVERITIES) + 6))})",
+                       (image_name, scan_name, scanned_at.isoformat(timespec='seconds'),
+                        *severities.values(), stats.get('total_vulnerabilities', sum(severities.values())),
+                        stats.get('fixable_vulnerabilities', 0), json.dumps(stats.get('top_vulnerable_packages', {}))))
+
+    def append_scan(self, image_name, scan_file, stats_file=None):
+        """Record a scan's rollup from its statistics file, or by streaming the scan if there is none"""
+        scan_name = os.path.basename(scan_file)
+        if self.has(image_name, scan_name):
+            return
+        if stats_file and os.path.exists(stats_file):
+            with open(stats_file, 'r') as f:
+                stats = json.load(f)
+        else:
+            accumulator = StatsAccumulator()
+            with open(scan_file, 'r') as f:
+                for match in iter_grype_matches(f):
+                    accumulator.add(match)
+            stats = accumulator.result()
+        self.append(image_name, scan_name, scan_time(scan_file), stats)
+
+    def images(self):
+        with self._connect() as db:
+            return [row[0] for row in db.execute(
+                "SELECT image FROM rollups GROUP BY image ORDER BY MAX(scanned_at) DESC")]
+
+    def query(self, image_name, start, end):
+        """Return the rollups of an image scanned between start and end, oldest first"""
+        columns = ['scan', 'scanned_at', *(severity.lower() for severity in self.SEVERITIES),
+                   'total', 'fixable', 'top_packages']
+        with self._connect() as db:
+            rows = db.execute(f"SELECT {', '.join(columns)} FROM rollups WHERE image = ? AND scanned_at >= ? "
+                              "AND scanned_at <= ? ORDER BY scanned_at",
+                              (image_name, start.isoformat(timespec='seconds'), end.isoformat(timespec='seconds')))
+            rollups = [dict(zip(columns, row)) for row in rows]
+        for rollup in rollups:
+            rollup['top_packages'] = json.loads(rollup['top_packages'])
+        return rollups
+
+
+def compact_scan_history(output_dir, image_name, trends, older_than_days, store=None):
+    """Roll up every scan of an image, then archive its runs older than older_than_days.
+
+    Published files and files of other images are never archived. Old runs are packed into one tar.xz per call under
+    output_dir/archive and removed once the archive is complete. Scans already pruned into
+    the store are rolled up from the store.
+    """
+    if store:
+        for stored in store.scans(image_name):
+            if not trends.has(image_name, stored['name']):
+                accumulator = StatsAccumulator()
+                for match in store.iter_matches(stored['id'], keys={'vulnerability', 'artifact'}):
+                    accumulator.add(match)
+                trends.append(image_name, stored['name'], datetime.fromisoformat(stored['scanned_at']),
+                              accumulator.result())
+
+    published = {os.path.realpath(os.path.join(output_dir, name)) for name in os.listdir(output_dir)
+                 if os.path.islink(os.path.join(output_dir, name))}
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    old_files = []
+    # Only runs of this image are rolled up or archived, as other images may share output_dir
+    for timestamp, paths in sorted(image_runs(output_dir, image_name).items()):
+        trends.append_scan(image_name, os.path.join(output_dir, f"vulnerability_scan_{timestamp}.json"),
+                           os.path.join(output_dir, f"scan_stats_{timestamp}.json"))
+        if datetime.strptime(timestamp, "%Y%m%d_%H%M%S") < cutoff:
+            old_files.extend(sorted(path for path in paths if os.path.realpath(path) not in published))
+    if not old_files:
+        return None
+
+    archive_dir = os.path.join(output_dir, 'archive')
+    os.makedirs(archive_dir, exist_ok=True)
+    timestamps = sorted(TIMESTAMPED_ARTIFACT.match(os.path.basename(path)).group(2) for path in old_files)
+    archive = os.path.join(archive_dir, f"scans_{timestamps[0]}_{timestamps[-1]}.tar.xz")
+    tmp_archive = f"{archive}.tmp"
+    with tarfile.open(tmp_archive, 'w:xz') as tar:
+        for path in old_files:
+            tar.add(path, arcname=os.path.basename(path))
+    os.replace(tmp_archive, archive)
+    for path in old_files:
+        os.remove(path)
+    print(f"Archived {len(old_files)} files of {image_name} into {archive}")
+    return archive
+
+
+def get_repo_digest(image_name):
+    """Return the registry digest Docker recorded when the image was pulled, or None"""
+    output = run_command([DOCKER_BIN, 'image', 'inspect', '--format', '{{json .RepoDigests}}', image_name])
+    try:
+        repo_digests = json.loads(output) if output else None
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(repo_digests, list) or not repo_digests:
+        return None
+    # Prefer the entry for the repository that was pulled, e.g. alpine for alpine:3.19
+    repository = image_name.split('@')[0]
+    if ':' in repository.rsplit('/', 1)[-1]:
+        repository = repository.rsplit(':', 1)[0]
+    for entry in repo_digests:
+        if entry.split('@')[0] == repository:
+            return entry.split('@', 1)[1]
+    return repo_digests[0].split('@', 1)[1] if '@' in repo_digests[0] else None
+
+
+def get_image_digest(image_name):
+    """Return the content digest of a pulled image, or None if Docker cannot inspect it"""
+    output = run_command([DOCKER_BIN, 'image', 'inspect', '--format', '{{.Id}}', image_name])
+    return output.strip() if output else None
 
 
 def generate_sbom_with_syft(image_name, output_file="sbom.json"):
     """Generate a Software Bill of Materials (SBOM) using Syft"""
     print(f"Generating SBOM with Syft: {image_name}")
-    result = run_command(f"syft {image_name} -o json > {output_file}")
+    result = run_command([SYFT_BIN, image_name, '-o', 'json'], output_file)
     if not result:
         # Syft outputs directly to file, so we don't use the result
         # Just check if the file exists
@@ -57,48 +678,237 @@ def generate_sbom_with_syft(image_name, output_file="sbom.json"):
     return output_file
 
 
+VULNERABILITY_FIELDS = ['id', 'severity', 'package', 'version', 'type', 'fixed_version', 'description']
+
+
+def generate_sbom_cached(image_name, output_file, cache_dir, digest):
+    """Generate an SBOM with Syft, reusing a previous one for the same image digest"""
+    if not digest:
+        return generate_sbom_with_syft(image_name, output_file)
+
+    cached_sbom = os.path.join(cache_dir, f"{digest.replace(':', '_')}.json")
+    if os.path.exists(cached_sbom):
+        print(f"Reusing cached SBOM for {image_name} ({digest})")
+        shutil.copyfile(cached_sbom, output_file)
+        return output_file
+
+    sbom_file = generate_sbom_with_syft(image_name, output_file)
+    if sbom_file:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Copy under a temporary name so concurrent runs never read a partial cache entry
+        tmp_sbom = f"{cached_sbom}.{os.getpid()}.tmp"
+        shutil.copyfile(sbom_file, tmp_sbom)
+        os.replace(tmp_sbom, cached_sbom)
+    return sbom_file
+
+
+def vulnerability_row(match):
+    """Flatten a Grype match into the row written to the JSON and CSV reports"""
+    vulnerability = match.get('vulnerability', {})
+    artifact = match.get('artifact', {})
+    fixed_versions = vulnerability.get('fix', {}).get('versions')
+    return {
+        'id': vulnerability.get('id', 'N/A'),
+        'severity': vulnerability.get('severity', '').upper(),
+        'package': artifact.get('name', 'N/A'),
+        'version': artifact.get('version', 'N/A'),
+        'type': artifact.get('type', 'N/A'),
+        'fixed_version': fixed_versions[0] if fixed_versions else 'N/A',
+        'description': vulnerability.get('description', 'N/A')
+    }
+
+
+class JsonStreamReader:
+    """Minimal incremental JSON reader over a text stream.
+
+    Values are decoded one at a time with json.JSONDecoder.raw_decode, so memory is bounded
+    by the largest single value rather than the whole document.
+    """
+
+    _WHITESPACE = ' \t\n\r'
+
+    def __init__(self, stream, chunk_size=64 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=None):
+        if self.eof:
+            return False
+        # Drop consumed input before reading more so the buffer never grows past one value
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        chunk = self.stream.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it, or '' at the end"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self._WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of buffered JSON")
+        self.pos += 1
+
+    def decode(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number or literal at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow reads with the pending value so very large values are not re-scanned too often
+            self._fill(max(self.chunk_size, len(self.buffer) - self.pos))
+
+    def iter_object(self):
+        """Yield (key, reader) pairs of an object; the caller must consume each value"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(':')
+            yield key, self
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+    def iter_array(self):
+        """Yield the decoded elements of an array one at a time"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+
+def iter_grype_matches(stream, metadata=None):
+    """Yield the matches of a Grype JSON document one at a time.
+
+    Other top-level fields (source, distro, descriptor) are stored in metadata if given.
+    """
+    reader = JsonStreamReader(stream)
+    for key, value_reader in reader.iter_object():
+        if key == 'matches':
+            for match in value_reader.iter_array():
+                if not isinstance(match, dict):
+                    raise ValueError(f"Expected a match object, got {type(match).__name__}")
+                yield match
+        elif metadata is not None:
+            metadata[key] = value_reader.decode()
+        else:
+            value_reader.decode()
+
+
+class CriticalHighWriter:
+    """Writes critical and high matches to the JSON and CSV reports as they are seen"""
+
+    def __init__(self, output_json, output_csv):
+        self.output_json = output_json
+        self.output_csv = output_csv
+        self.vulnerabilities = []
+        self._json_file = open(output_json, 'w')
+        self._csv_file = open(output_csv, 'w', newline='')
+        self._csv_writer = csv.DictWriter(self._csv_file, fieldnames=VULNERABILITY_FIELDS)
+        self._csv_writer.writeheader()
+
+    def add(self, match):
+        vuln = vulnerability_row(match)
+        if vuln['severity'] not in ['CRITICAL', 'HIGH']:
+            return
+        # Same layout as json.dump(rows, indent=2), written one row at a time
+        self._json_file.write('[\n  ' if not self.vulnerabilities else ',\n  ')
+        self._json_file.write(json.dumps(vuln, indent=2).replace('\n', '\n  '))
+        self._csv_writer.writerow(vuln)
+        self.vulnerabilities.append(vuln)
+
+    def close(self):
+        self._json_file.write('\n]' if self.vulnerabilities else '[]')
+        self._json_file.close()
+        self._csv_file.close()
+        return self.vulnerabilities
+
+
+class StatsAccumulator:
+    """Aggregates the vulnerability statistics of a scan one match at a time"""
+
+    def __init__(self):
+        self.total = 0
+        self.severity_counts = {}
+        self.package_counts = {}
+        self.fixable_count = 0
+
+    def add(self, match):
+        self.total += 1
+
+        # Count by severity
+        severity = match.get('vulnerability', {}).get('severity', 'unknown')
+        self.severity_counts[severity] = self.severity_counts.get(severity, 0) + 1
+
+        # Count by package
+        package = match.get('artifact', {}).get('name', 'unknown')
+        self.package_counts[package] = self.package_counts.get(package, 0) + 1
+
+        # Check if there are any fixable vulnerabilities
+        if match.get('vulnerability', {}).get('fix', {}).get('state') == 'fixed':
+            self.fixable_count += 1
+
+    def result(self, timestamp='unknown'):
+        # Get top 5 vulnerable packages
+        top_packages = sorted(self.package_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+        return {
+            "total_vulnerabilities": self.total,
+            "severity_distribution": self.severity_counts,
+            "top_vulnerable_packages": dict(top_packages),
+            "fixable_vulnerabilities": self.fixable_count,
+            "scan_timestamp": timestamp
+        }
+
+
 def parse_critical_and_high_vulnerabilities(input_file, output_json="critical_high_vulns.json",
                                             output_csv="critical_high_vulns.csv"):
-    """Parse the Grype scan results and extract critical and high vulnerabilities"""
+    """Parse the Grype scan results and extract critical and high vulnerabilities.
+
+    Matches are streamed from the file one at a time and written straight to the reports,
+    so memory does not grow with the size of the scan.
+    """
     print(f"Parsing critical and high vulnerabilities from: {input_file}")
     try:
-        with open(input_file, 'r') as f:
-            scan_data = json.load(f)
-
-        # Extract critical and high vulnerabilities
-        critical_high_vulns = []
-        for match in scan_data.get('matches', []):
-            severity = match.get('vulnerability', {}).get('severity', '').upper()
-            if severity in ['CRITICAL', 'HIGH']:
-                vuln = {
-                    'id': match.get('vulnerability', {}).get('id', 'N/A'),
-                    'severity': severity,
-                    'package': match.get('artifact', {}).get('name', 'N/A'),
-                    'version': match.get('artifact', {}).get('version', 'N/A'),
-                    'type': match.get('artifact', {}).get('type', 'N/A'),
-                    'fixed_version': match.get('vulnerability', {}).get('fix', {}).get('versions', ['N/A'])[
-                        0] if match.get('vulnerability', {}).get('fix', {}).get('versions') else 'N/A',
-                    'description': match.get('vulnerability', {}).get('description', 'N/A')
-                }
-                critical_high_vulns.append(vuln)
-
-        # Save as JSON
-        with open(output_json, 'w') as f:
-            json.dump(critical_high_vulns, f, indent=2)
-
-        # Save as CSV
-        if critical_high_vulns:
-            with open(output_csv, 'w', newline='') as f:
-                fieldnames = critical_high_vulns[0].keys()
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(critical_high_vulns)
-        else:
-            # Create an empty CSV with headers if no vulnerabilities found
-            with open(output_csv, 'w', newline='') as f:
-                fieldnames = ['id', 'severity', 'package', 'version', 'type', 'fixed_version', 'description']
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writeheader()
+        writer = CriticalHighWriter(output_json, output_csv)
+        try:
+            with open(input_file, 'r') as f:
+                for match in iter_grype_matches(f):
+                    writer.add(match)
+        finally:
+            critical_high_vulns = writer.close()
 
         print(f"Found {len(critical_high_vulns)} critical/high vulnerabilities")
         print(f"Results saved to {output_json} and {output_csv}")
@@ -109,74 +919,994 @@ def parse_critical_and_high_vulnerabilities(input_file, output_json="critical_hi
         return []
 
 
-def upload_to_s3(file_path, bucket_name, object_key=None):
+class TeeReader:
+    """Text reader over a binary stream that copies every byte it reads into a set of sinks"""
+
+    def __init__(self, stream, sinks):
+        self.stream = stream
+        self.sinks = sinks
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        for sink in self.sinks:
+            sink.write(data)
+        return self._decoder.decode(data, final=not data)
+
+    def drain(self, chunk_size=64 * 1024):
+        """Copy whatever the parser did not consume so every sink receives the full output"""
+        while self.read(chunk_size):
+            pass
+
+
+def scan_and_report_with_grype(target, scan_output, critical_high_json, critical_high_csv, stats_output,
+                               compressed_output=None, snapshot_output=None):
+    """Scan with Grype and build every report in the same pass over its output.
+
+    Grype runs without a shell and its stdout is teed into the scan file, an optional gzip
+    copy, the critical/high writer, the statistics and the columnar snapshot, so the scan is
+    never re-read from disk and parsing overlaps with the scan itself.
+    """
+    print(f"Scanning image with Grype: {target}")
+    command = [GRYPE_BIN, target, '-o', 'json']
+    writer = CriticalHighWriter(critical_high_json, critical_high_csv)
+    stats = StatsAccumulator()
+    snapshot = SnapshotWriter() if snapshot_output else None
+    metadata = {}
+
+    with tempfile.TemporaryFile() as stderr, open(scan_output, 'wb') as scan_file:
+        sinks = [scan_file]
+        compressed_file = gzip.open(compressed_output, 'wb') if compressed_output else None
+        if compressed_file:
+            sinks.append(compressed_file)
+
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+        tee = TeeReader(process.stdout, sinks)
+        parsed = True
+        try:
+            for match in iter_grype_matches(tee, metadata):
+                writer.add(match)
+                stats.add(match)
+                if snapshot:
+                    snapshot.add(match)
+        except ValueError as e:
+            print(f"Error parsing vulnerabilities: {str(e)}")
+            parsed = False
+        finally:
+            tee.drain()
+            process.stdout.close()
+            returncode = process.wait()
+            vulnerabilities = writer.close()
+            if compressed_file:
+                compressed_file.close()
+
+        if returncode != 0:
+            stderr.seek(0)
+            print(f"Error executing command: {' '.join(command)}")
+            print(f"STDERR: {stderr.read().decode(errors='replace')}")
+
+    # A scan that can't be parsed must not be published or cached as a clean result
+    if returncode != 0 or not parsed:
+        for path in (scan_output, compressed_output, critical_high_json, critical_high_csv):
+            if path and os.path.exists(path):
+                os.unlink(path)
+        return None
+
+    with open(stats_output, 'w') as f:
+        json.dump(stats.result(metadata.get('timestamp', 'unknown')), f, indent=2)
+    if snapshot:
+        snapshot.write(snapshot_output, snapshot_metadata(metadata, stats))
+
+    print(f"Scan complete. Results saved to {scan_output}")
+    print(f"Found {len(vulnerabilities)} critical/high vulnerabilities")
+    print(f"Results saved to {critical_high_json} and {critical_high_csv}")
+    return {'scan_file': scan_output, 'vulnerabilities': vulnerabilities, 'compressed_file': compressed_output,
+            'snapshot_file': snapshot_output}
+
+
+def compute_vulnerability_stats(scan_data):
+    """Summarise a Grype scan by severity, package and fix availability"""
+    stats = StatsAccumulator()
+    for match in scan_data.get('matches', []):
+        stats.add(match)
+    return stats.result(scan_data.get('timestamp', 'unknown'))
+
+
+SNAPSHOT_MAGIC = b'GSNAP001'
+SNAPSHOT_HEADER = struct.Struct('=8sIII')
+SEVERITY_LEVELS = ['Unknown', 'Negligible', 'Low', 'Medium', 'High', 'Critical']
+FIX_STATES = ['unknown', 'fixed', 'not-fixed', 'wont-fix']
+# Column name and array typecode, in file order; string columns hold indexes into the string table
+SNAPSHOT_COLUMNS = [
+    ('id', 'I'),
+    ('package', 'I'),
+    ('version', 'I'),
+    ('type', 'I'),
+    ('fixed_version', 'I'),
+    ('severity', 'B'),
+    ('fix_state', 'B'),
+    ('epss', 'f'),
+    ('epss_percentile', 'f'),
+    ('cvss', 'f'),
+]
+SNAPSHOT_STRING_COLUMNS = ['id', 'package', 'version', 'type', 'fixed_version']
+
+
+def _snapshot_align(offset):
+    return (offset + 7) & ~7
+
+
+def match_risk_inputs(match):
+    """Return the highest EPSS score, EPSS percentile and CVSS base score recorded for a match"""
+    vulnerability = match.get('vulnerability', {})
+    epss = [entry for entry in vulnerability.get('epss') or [] if isinstance(entry, dict)]
+    cvss_entries = list(vulnerability.get('cvss') or [])
+    for related in match.get('relatedVulnerabilities') or []:
+        cvss_entries.extend(related.get('cvss') or [])
+    base_scores = [(entry.get('metrics') or {}).get('baseScore') for entry in cvss_entries if isinstance(entry, dict)]
+    return (_max_number(entry.get('epss') for entry in epss),
+            _max_number(entry.get('percentile') for entry in epss),
+            _max_number(base_scores))
+
+
+def _max_number(values):
+    """Largest numeric value, skipping missing or non-numeric entries, or NaN if there are none"""
+    return max((float(value) for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)),
+               default=float('nan'))
+
+
+def single_precision(value):
+    """Round a float to the single precision the snapshot columns store"""
+    return array.array('f', [value])[0]
+
+
+def snapshot_row(match):
+    """Flatten a Grype match into the same row ScanSnapshot.row decodes for it"""
+    base = vulnerability_row(match)
+    row = {name: str(base[name]) for name in SNAPSHOT_STRING_COLUMNS}
+    severity = base['severity'].capitalize()
+    row['severity'] = (severity if severity in SEVERITY_LEVELS else SEVERITY_LEVELS[0]).upper()
+    fix_state = match.get('vulnerability', {}).get('fix', {}).get('state', 'unknown')
+    row['fix_state'] = fix_state if fix_state in FIX_STATES else FIX_STATES[0]
+    for name, value in zip(('epss', 'epss_percentile', 'cvss'), match_risk_inputs(match)):
+        value = single_precision(value)
+        row[name] = None if math.isnan(value) else round(value, 5)
+    return row
+
+
+class SnapshotWriter:
+    """Builds a columnar snapshot of a scan one match at a time.
+
+    The file holds a header, a small JSON metadata block, one fixed-width column per field
+    and a sorted string table, so readers can mmap it and answer queries without parsing.
+    Columns use native byte order, as the snapshot is read on the host that wrote it.
+    """
+
+    def __init__(self):
+        self.columns = {name: array.array(code) for name, code in SNAPSHOT_COLUMNS}
+        self._strings = {}
+
+    def _intern(self, value):
+        value = str(value)
+        index = self._strings.get(value)
+        if index is None:
+            index = self._strings[value] = len(self._strings)
+        return index
+
+    def add(self, match):
+        row = vulnerability_row(match)
+        for name in SNAPSHOT_STRING_COLUMNS:
+            self.columns[name].append(self._intern(row[name]))
+        severity = row['severity'].capitalize()
+        self.columns['severity'].append(SEVERITY_LEVELS.index(severity) if severity in SEVERITY_LEVELS else 0)
+        fix_state = match.get('vulnerability', {}).get('fix', {}).get('state', 'unknown')
+        self.columns['fix_state'].append(FIX_STATES.index(fix_state) if fix_state in FIX_STATES else 0)
+        epss, epss_percentile, cvss = match_risk_inputs(match)
+        self.columns['epss'].append(epss)
+        self.columns['epss_percentile'].append(epss_percentile)
+        self.columns['cvss'].append(cvss)
+
+    def write(self, output_file, metadata):
+        """Write the snapshot atomically, sorting the string table so lookups can bisect it"""
+        strings = sorted(self._strings, key=lambda value: value.encode('utf-8'))
+        remap = array.array('I', [0] * len(strings))
+        for new_index, value in enumerate(strings):
+            remap[self._strings[value]] = new_index
+        for name in SNAPSHOT_STRING_COLUMNS:
+            self.columns[name] = array.array('I', (remap[index] for index in self.columns[name]))
+
+        encoded = [value.encode('utf-8') for value in strings]
+        offsets = array.array('I', [0])
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        meta = json.dumps(metadata).encode('utf-8')
+        rows = len(self.columns['id'])
+
+        tmp_file = f"{output_file}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, rows, len(encoded), len(meta)))
+            f.write(meta)
+            for name, _ in SNAPSHOT_COLUMNS:
+                f.write(b'\0' * (_snapshot_align(f.tell()) - f.tell()))
+                self.columns[name].tofile(f)
+            f.write(b'\0' * (_snapshot_align(f.tell()) - f.tell()))
+            offsets.tofile(f)
+            f.write(b''.join(encoded))
+        os.replace(tmp_file, output_file)
+        return output_file
+
+
+class ScanSnapshot:
+    """Read-only, memory-mapped view of a columnar scan snapshot.
+
+    Pages are shared between every process that maps the same file, and nothing is decoded
+    until a row or string is actually requested.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, self.rows, string_count, meta_length = SNAPSHOT_HEADER.unpack_from(view)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a scan snapshot")
+        offset = SNAPSHOT_HEADER.size
+        self.metadata = json.loads(bytes(view[offset:offset + meta_length]))
+        offset += meta_length
+
+        self.columns = {}
+        for name, code in SNAPSHOT_COLUMNS:
+            offset = _snapshot_align(offset)
+            size = self.rows * struct.calcsize(code)
+            self.columns[name] = view[offset:offset + size].cast(code)
+            offset += size
+        offset = _snapshot_align(offset)
+        self._string_offsets = view[offset:offset + (string_count + 1) * 4].cast('I')
+        self._strings = view[offset + (string_count + 1) * 4:]
+        self.string_count = string_count
+
+    def _string_bytes(self, index):
+        return self._strings[self._string_offsets[index]:self._string_offsets[index + 1]]
+
+    def string(self, index):
+        return bytes(self._string_bytes(index)).decode('utf-8')
+
+    def find_string(self, value):
+        """Return the string table index of value, or None, by bisecting the sorted table"""
+        target = value.encode('utf-8')
+        low, high = 0, self.string_count
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(self._string_bytes(middle)) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.string_count and bytes(self._string_bytes(low)) == target:
+            return low
+        return None
+
+    def row(self, index):
+        """Decode one row into the report shape used by the critical/high files"""
+        columns = self.columns
+        row = {name: self.string(columns[name][index]) for name in SNAPSHOT_STRING_COLUMNS}
+        row['severity'] = SEVERITY_LEVELS[columns['severity'][index]].upper()
+        row['fix_state'] = FIX_STATES[columns['fix_state'][index]]
+        for name in ('epss', 'epss_percentile', 'cvss'):
+            value = columns[name][index]
+            row[name] = None if math.isnan(value) else round(value, 5)
+        return row
+
+    def filter(self, severity=None, package=None, fixable=None):
+        """Return the indexes of rows matching severity names, package name and fix availability"""
+        indexes = range(self.rows)
+        if severity:
+            levels = {SEVERITY_LEVELS.index(s.capitalize()) for s in severity if s.capitalize() in SEVERITY_LEVELS}
+            column = self.columns['severity']
+            indexes = [i for i in indexes if column[i] in levels]
+        if package:
+            package_index = self.find_string(package)
+            column = self.columns['package']
+            indexes = [i for i in indexes if column[i] == package_index]
+        if fixable is not None:
+            fixed = FIX_STATES.index('fixed')
+            column = self.columns['fix_state']
+            indexes = [i for i in indexes if (column[i] == fixed) == fixable]
+        return indexes
+
+    def stats(self):
+        """Statistics recorded when the snapshot was written"""
+        return dict(self.metadata.get('stats', {}))
+
+
+def write_scan_snapshot(scan_file, output_file):
+    """Build a columnar snapshot from an existing Grype JSON file"""
+    writer = SnapshotWriter()
+    stats = StatsAccumulator()
+    metadata = {}
+    with open(scan_file, 'r') as f:
+        for match in iter_grype_matches(f, metadata):
+            writer.add(match)
+            stats.add(match)
+    return writer.write(output_file, snapshot_metadata(metadata, stats))
+
+
+def snapshot_metadata(scan_metadata, stats):
+    """Small metadata block stored in a snapshot header"""
+    target = scan_metadata.get('source', {}).get('target', {})
+    return {
+        'image': target.get('userInput') if isinstance(target, dict) else None,
+        'stats': stats.result(scan_metadata.get('timestamp', 'unknown'))
+    }
+
+
+def upload_to_s3(file_path, bucket_name, object_key=None, endpoint_url=None):
     """Upload a file to an S3 bucket"""
     if not object_key:
         object_key = os.path.basename(file_path)
 
     print(f"Uploading {file_path} to S3 bucket {bucket_name} as {object_key}")
-    return run_command(f"aws s3 cp {file_path} s3://{bucket_name}/{object_key}")
+    endpoint = ['--endpoint-url', endpoint_url] if endpoint_url else []
+    return run_command([AWS_BIN, 's3', 'cp', file_path, f"s3://{bucket_name}/{object_key}", *endpoint])
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Scan a Docker image and generate reports')
-    parser.add_argument('--image', default='python:3.9-slim', help='Docker image to scan (default: python:3.9-slim)')
-    parser.add_argument('--s3-bucket', help='S3 bucket to upload results to (optional)')
-    args = parser.parse_args()
+class S3Uploader:
+    """Uploads artifacts to S3 concurrently, as soon as each one is submitted.
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    scan_output = f"vulnerability_scan_{timestamp}.json"
-    sbom_output = f"sbom_{timestamp}.json"
-    critical_high_json = f"critical_high_vulns_{timestamp}.json"
-    critical_high_csv = f"critical_high_vulns_{timestamp}.csv"
+    Files at or above the multipart threshold are sent in parallel parts, and objects whose
+    ETag already matches the local file are skipped. endpoint_url points the client at an
+    S3-compatible stand-in (e.g. a local moto or MinIO server) for tests. Without boto3 the
+    AWS CLI is used instead, still from the worker pool.
+    """
+
+    def __init__(self, bucket_name, workers=4, endpoint_url=None, multipart_threshold=8 * 1024 * 1024,
+                 multipart_chunksize=8 * 1024 * 1024):
+        self.bucket_name = bucket_name
+        self.endpoint_url = endpoint_url
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = multipart_chunksize
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        if boto3:
+            self._client = boto3.client('s3', endpoint_url=endpoint_url)
+            self._config = TransferConfig(multipart_threshold=multipart_threshold,
+                                          multipart_chunksize=multipart_chunksize)
+        else:
+            print("boto3 is not installed, falling back to the AWS CLI for uploads")
+            self._client = None
+            self._config = None
+
+    def submit(self, file_path, object_key=None):
+        """Queue a file for upload and return a future resolving to uploaded, skipped or failed"""
+        return self._executor.submit(self._upload, file_path, object_key or os.path.basename(file_path))
+
+    def close(self):
+        """Wait for every queued upload to finish"""
+        self._executor.shutdown(wait=True)
+
+    def local_etag(self, file_path):
+        """Compute the ETag S3 reports for this file when uploaded with our multipart settings"""
+        part_digests = []
+        with open(file_path, 'rb') as f:
+            for part in iter(lambda: f.read(self.multipart_chunksize), b''):
+                part_digests.append(hashlib.md5(part).digest())
+        if os.path.getsize(file_path) < self.multipart_threshold:
+            return part_digests[0].hex() if part_digests else hashlib.md5(b'').hexdigest()
+        return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+    def _remote_etag(self, object_key):
+        try:
+            response = self._client.head_object(Bucket=self.bucket_name, Key=object_key)
+        except ClientError:
+            return None
+        return response.get('ETag', '').strip('"')
+
+    def _upload(self, file_path, object_key):
+        try:
+            if self._client is None:
+                uploaded = upload_to_s3(file_path, self.bucket_name, object_key, self.endpoint_url)
+                return 'uploaded' if uploaded is not None else 'failed'
+
+            if self._remote_etag(object_key) == self.local_etag(file_path):
+                print(f"Skipping {file_path}, s3://{self.bucket_name}/{object_key} is up to date")
+                return 'skipped'
+
+            print(f"Uploading {file_path} to S3 bucket {self.bucket_name} as {object_key}")
+            self._client.upload_file(file_path, self.bucket_name, object_key, Config=self._config)
+            return 'uploaded'
+        except Exception as e:
+            print(f"Error uploading {file_path} to S3: {str(e)}")
+            return 'failed'
+
+
+def image_slug(image_name):
+    """Return a filesystem-safe directory name for an image reference"""
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', image_name)
+
+
+IMAGE_OWNER_FILE = '.image'
+
+
+def image_dir_owner(image_dir):
+    """Return the image a per-image results directory belongs to, or None if it is unclaimed"""
+    try:
+        with open(os.path.join(image_dir, IMAGE_OWNER_FILE), 'r') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def claim_image_dir(image_dir, image_name):
+    """Record image_name as the owner of a per-image directory.
+
+    Different references can share a slug (a/b and a_b), so the first image to use a
+    directory claims it and False is returned for any other image.
+    """
+    os.makedirs(image_dir, exist_ok=True)
+    try:
+        fd = os.open(os.path.join(image_dir, IMAGE_OWNER_FILE), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        return image_dir_owner(image_dir) == image_name
+    with os.fdopen(fd, 'w') as f:
+        f.write(f"{image_name}\n")
+    return True
+
+
+def publish_latest(links):
+    """Point the latest symlinks at a complete set of new artifacts.
+
+    Nothing is published until every artifact has been written, and the scan link, which
+    readers use to detect a new scan, is switched last.
+    """
+    for target_path, link_path in sorted(links, key=lambda link: link[1].endswith('vulnerability_scan.json')):
+        link_latest(target_path, link_path)
+
+
+def artifact_links(artifacts, output_dir):
+    """Pair each artifact recorded in the manifest with its latest link in output_dir"""
+    names = {
+        'scan': "vulnerability_scan.json",
+        'sbom': "sbom.json",
+        'critical_high_json': "critical_high_vulns.json",
+        'critical_high_csv': "critical_high_vulns.csv",
+        'stats': "scan_stats.json",
+        'snapshot': "vulnerability_scan.snap"
+    }
+    return [(artifacts[kind], os.path.join(output_dir, name)) for kind, name in names.items() if artifacts.get(kind)]
+
+
+def link_latest(target_path, link_path):
+    """Point the "latest" symlink at a timestamped file in the same directory.
+
+    The new link is created under a temporary name and renamed over the old one, so
+    readers always find either the previous or the new target, never a missing link.
+    """
+    tmp_path = f"{link_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    os.symlink(os.path.basename(target_path), tmp_path)
+    try:
+        os.replace(tmp_path, link_path)
+    except OSError:
+        os.unlink(tmp_path)
+        raise
+
+
+class StageLimiter:
+    """Bounds how many images may be in each pipeline stage at once and records stage timings"""
+
+    def __init__(self, limits):
+        self._semaphores = {stage: threading.BoundedSemaphore(limit) for stage, limit in limits.items()}
+
+    @contextmanager
+    def stage(self, name, timings, progress=None):
+        """Run a stage, reporting (stage, "running") and (stage, "done", seconds) to progress"""
+        semaphore = self._semaphores.get(name)
+        if semaphore:
+            semaphore.acquire()
+        start = time.monotonic()
+        if progress:
+            progress(name, 'running')
+        try:
+            yield
+        finally:
+            timings[name] = round(time.monotonic() - start, 2)
+            if semaphore:
+                semaphore.release()
+            if progress:
+                progress(name, 'done', timings[name])
+
+
+def scan_image(image_name, output_dir='.', s3_bucket=None, stages=None, stage_executor=None,
+               sbom_first=False, sbom_cache_dir='sbom-cache', manifest=None, db_version=None, force=False,
+               compress=False, uploader=None, progress=None, package_index=None, store=None, trends=None):
+    """Pull, scan, catalogue and report on one image, returning its artifacts and stage timings.
+
+    Grype and Syft run concurrently when a stage_executor is given, and the stage limiter
+    bounds how many images are in each stage across a multi-image run. With sbom_first,
+    Syft catalogues the image once (or the SBOM is reused from the digest-keyed cache)
+    and Grype matches against that SBOM instead of unpacking the image again.
+
+    When a manifest is given, the registry digest is resolved before pulling and the
+    previous artifacts are reused unless force is set or the digest or Grype DB version changed.
+    With compress, a gzip copy of the scan is written in the same pass as the scan itself.
+    Each artifact is handed to the uploader as soon as it is written; if only s3_bucket is
+    given, a private uploader is created for this image. progress, if given, is called as
+    progress(stage, "running") and progress(stage, "done", seconds) around each stage.
+    The image's packages are added to package_index from its SBOM if an index is given.
+    With a store, the scan is added to the deduplicated history and older raw files are pruned.
+    With trends, a rollup of the scan is appended to the trend time series.
+    """
+    stages = stages or StageLimiter({})
+    timings = {}
+    started = time.monotonic()
+    os.makedirs(output_dir, exist_ok=True)
 
     # Create symlinks for the latest files
-    latest_scan = "vulnerability_scan.json"
-    latest_sbom = "sbom.json"
-    latest_critical_high_json = "critical_high_vulns.json"
-    latest_critical_high_csv = "critical_high_vulns.csv"
+    latest_scan = os.path.join(output_dir, "vulnerability_scan.json")
+    latest_sbom = os.path.join(output_dir, "sbom.json")
+    latest_critical_high_json = os.path.join(output_dir, "critical_high_vulns.json")
+    latest_critical_high_csv = os.path.join(output_dir, "critical_high_vulns.csv")
+    latest_stats = os.path.join(output_dir, "scan_stats.json")
+    latest_snapshot = os.path.join(output_dir, "vulnerability_scan.snap")
+
+    def reuse(artifacts):
+        print(f"{image_name} unchanged ({digest}), reusing previous results")
+        if not artifacts.get('snapshot'):
+            # Entries recorded before snapshots existed get one now, so the server can map it
+            snapshot_file = os.path.splitext(artifacts['scan'])[0] + '.snap'
+            try:
+                if not os.path.exists(snapshot_file):
+                    write_scan_snapshot(artifacts['scan'], snapshot_file)
+                artifacts = dict(artifacts, snapshot=snapshot_file)
+            except (OSError, ValueError) as e:
+                print(f"Error writing snapshot for {image_name}: {str(e)}")
+        publish_latest(artifact_links(artifacts, output_dir))
+        if package_index:
+            package_index.update(image_name, artifacts['sbom'], digest)
+        with open(artifacts['critical_high_json'], 'r') as f:
+            vulnerabilities = json.load(f)
+        timings['total'] = round(time.monotonic() - started, 2)
+        return {
+            'image': image_name,
+            'ok': True,
+            'cached': True,
+            'scan_file': artifacts['scan'],
+            'sbom_file': artifacts['sbom'],
+            'vulnerabilities': vulnerabilities,
+            'timings': timings
+        }
+
+    digest = None
+    if manifest:
+        with stages.stage('resolve', timings, progress):
+            digest = resolve_remote_digest(image_name)
+            db_version = db_version or get_grype_db_version()
+            artifacts = None if force else manifest.lookup(image_name, digest, db_version)
+        if artifacts:
+            return reuse(artifacts)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    scan_output = os.path.join(output_dir, f"vulnerability_scan_{timestamp}.json")
+    sbom_output = os.path.join(output_dir, f"sbom_{timestamp}.json")
+    critical_high_json = os.path.join(output_dir, f"critical_high_vulns_{timestamp}.json")
+    critical_high_csv = os.path.join(output_dir, f"critical_high_vulns_{timestamp}.csv")
+    stats_output = os.path.join(output_dir, f"scan_stats_{timestamp}.json")
+    snapshot_output = os.path.join(output_dir, f"vulnerability_scan_{timestamp}.snap")
+
+    own_uploader = None
+    if s3_bucket and uploader is None:
+        uploader = own_uploader = S3Uploader(s3_bucket)
+    # Multi-image runs share a bucket, so keep each image's objects apart
+    key_prefix = '' if os.path.abspath(output_dir) == os.path.abspath('.') else f"{image_slug(image_name)}/"
+    uploads = []
+
+    def upload(path, prefix):
+        if uploader and path:
+            uploads.append(uploader.submit(path, f"{prefix}/{key_prefix}{os.path.basename(path)}"))
 
     # Pull the Docker image
-    pull_docker_image(args.image)
+    with stages.stage('pull', timings, progress):
+        pull_docker_image(image_name)
+
+    if manifest and not digest:
+        # Without buildx or registry access, fall back to the digest recorded by the pull
+        digest = get_repo_digest(image_name)
+        if not digest:
+            print(f"Warning: could not resolve a digest for {image_name}, its results will not be reused")
+        elif not force:
+            artifacts = manifest.lookup(image_name, digest, db_version)
+            if artifacts:
+                if own_uploader:
+                    own_uploader.close()
+                return reuse(artifacts)
+
+    def generate_sbom():
+        with stages.stage('sbom', timings, progress):
+            if sbom_first:
+                sbom = generate_sbom_cached(image_name, sbom_output, sbom_cache_dir, get_image_digest(image_name))
+            else:
+                sbom = generate_sbom_with_syft(image_name, sbom_output)
+        upload(sbom, 'sboms')
+        return sbom
+
+    if sbom_first:
+        # Grype needs the SBOM first, so catalogue the image before scanning
+        sbom_file = generate_sbom()
+        sbom_future = None
+        scan_target = f"sbom:{sbom_file}" if sbom_file else image_name
+    else:
+        # Generate SBOM with Syft, alongside the Grype scan when possible
+        sbom_future = stage_executor.submit(generate_sbom) if stage_executor else None
+        scan_target = image_name
 
-    # Scan with Grype
-    scan_file = scan_with_grype(args.image, scan_output)
+    # Scan with Grype, parsing critical/high vulnerabilities and statistics as the output streams in
+    with stages.stage('scan', timings, progress):
+        report = scan_and_report_with_grype(scan_target, scan_output, critical_high_json, critical_high_csv,
+                                            stats_output, f"{scan_output}.gz" if compress else None,
+                                            snapshot_output)
+    scan_file = report['scan_file'] if report else None
+    vulnerabilities = report['vulnerabilities'] if report else []
+    links = []
     if scan_file:
-        if os.path.exists(latest_scan) and os.path.islink(latest_scan):
-            os.unlink(latest_scan)
-        os.symlink(scan_output, latest_scan)
+        upload(scan_file, 'scans')
+        upload(report['compressed_file'], 'scans')
+        upload(critical_high_json, 'reports')
+        upload(critical_high_csv, 'reports')
+        links.extend([
+            (scan_output, latest_scan),
+            (critical_high_json, latest_critical_high_json),
+            (critical_high_csv, latest_critical_high_csv),
+            (stats_output, latest_stats),
+            (snapshot_output, latest_snapshot)
+        ])
 
-    # Generate SBOM with Syft
-    sbom_file = generate_sbom_with_syft(args.image, sbom_output)
+    if not sbom_first:
+        sbom_file = sbom_future.result() if sbom_future else generate_sbom()
     if sbom_file:
-        if os.path.exists(latest_sbom) and os.path.islink(latest_sbom):
-            os.unlink(latest_sbom)
-        os.symlink(sbom_output, latest_sbom)
+        links.append((sbom_output, latest_sbom))
 
-    # Parse critical and high vulnerabilities
-    if scan_file:
-        vulnerabilities = parse_critical_and_high_vulnerabilities(scan_file, critical_high_json, critical_high_csv)
+    # Create symlinks for the latest files once the whole set is complete
+    publish_latest(links)
+
+    # Wait for the uploads still in flight; most finish while later stages run
+    if uploads:
+        with stages.stage('upload', timings, progress):
+            upload_results = [future.result() for future in uploads]
+        if 'failed' in upload_results:
+            print(f"Some uploads failed for {image_name}")
+    if own_uploader:
+        own_uploader.close()
+
+    if package_index and sbom_file:
+        try:
+            package_index.update(image_name, sbom_file, digest)
+        except Exception as e:
+            print(f"Error indexing packages for {image_name}: {str(e)}")
+
+    if trends and scan_file:
+        try:
+            trends.append_scan(image_name, scan_file, stats_output)
+        except Exception as e:
+            print(f"Error recording trends for {image_name}: {str(e)}")
+
+    if store and scan_file:
+        try:
+            store.add(image_name, scan_file, sbom_file)
+            prune_stored_files(output_dir, image_name, store)
+        except Exception as e:
+            print(f"Error storing scan history for {image_name}: {str(e)}")
+
+    if manifest and scan_file and sbom_file:
+        manifest.record(image_name, digest, db_version, {
+            'scan': scan_file,
+            'sbom': sbom_file,
+            'critical_high_json': critical_high_json,
+            'critical_high_csv': critical_high_csv,
+            'stats': stats_output,
+            'snapshot': snapshot_output
+        })
+
+    timings['total'] = round(time.monotonic() - started, 2)
+    return {
+        'image': image_name,
+        'ok': bool(scan_file and sbom_file),
+        'cached': False,
+        'scan_file': scan_file,
+        'sbom_file': sbom_file,
+        'compressed_file': report['compressed_file'] if report else None,
+        'vulnerabilities': vulnerabilities,
+        'timings': timings
+    }
+
+
+def scan_images(image_names, output_dir, s3_bucket=None, workers=4, stage_limits=None, **scan_options):
+    """Scan many images through a bounded pool, each into its own directory under output_dir.
 
-        # Create symlinks for the latest files
-        if os.path.exists(latest_critical_high_json) and os.path.islink(latest_critical_high_json):
-            os.unlink(latest_critical_high_json)
-        os.symlink(critical_high_json, latest_critical_high_json)
+    Extra keyword arguments are passed through to scan_image.
+    """
+    stages = StageLimiter(stage_limits or {})
+    if scan_options.get('manifest') and not scan_options.get('db_version'):
+        # The DB version is shared by every image in the run, so only ask Grype once
+        scan_options['db_version'] = get_grype_db_version()
+    # Each image is scanned once, however often it is listed
+    image_names = list(dict.fromkeys(image_names))
+    with ThreadPoolExecutor(max_workers=workers) as stage_executor, \
+            ThreadPoolExecutor(max_workers=workers) as image_executor:
+        futures = []
+        for image_name in image_names:
+            image_dir = os.path.join(output_dir, image_slug(image_name))
+            if not claim_image_dir(image_dir, image_name):
+                futures.append(None)
+                continue
+            futures.append(image_executor.submit(scan_image, image_name, image_dir, s3_bucket, stages,
+                                                 stage_executor, **scan_options))
+        results = []
+        for image_name, future in zip(image_names, futures):
+            if future is None:
+                print(f"Error scanning {image_name}: {image_slug(image_name)} already holds results of "
+                      f"{image_dir_owner(os.path.join(output_dir, image_slug(image_name)))}")
+                results.append({'image': image_name, 'ok': False, 'vulnerabilities': [], 'timings': {}})
+                continue
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Error scanning {image_name}: {str(e)}")
+                results.append({'image': image_name, 'ok': False, 'vulnerabilities': [], 'timings': {}})
+        return results
 
-        if os.path.exists(latest_critical_high_csv) and os.path.islink(latest_critical_high_csv):
-            os.unlink(latest_critical_high_csv)
-        os.symlink(critical_high_csv, latest_critical_high_csv)
 
-        print("Summary of critical and high vulnerabilities:")
-        for vuln in vulnerabilities:
-            print(f"{vuln['id']} ({vuln['severity']}) - {vuln['package']} {vuln['version']}")
+def update_grype_db():
+    """Update the Grype vulnerability database and return its version"""
+    print("Updating Grype vulnerability database")
+    run_command([GRYPE_BIN, 'db', 'update'])
+    return get_grype_db_version()
 
-    # Upload to S3 if bucket is specified
+
+def disable_grype_db_update():
+    """Stop Grype in this process from updating the database on its own"""
+    os.environ['GRYPE_DB_AUTO_UPDATE'] = 'false'
+
+
+def match_key(match):
+    """Identify a finding by vulnerability and affected package"""
+    vulnerability = match.get('vulnerability', {})
+    artifact = match.get('artifact', {})
+    return vulnerability.get('id'), artifact.get('name'), artifact.get('version')
+
+
+def rematch_sbom(image_name, sbom_file, previous_scan, output_dir, compress=False):
+    """Match a stored SBOM against the current Grype DB and compare with the previous scan.
+
+    Runs in a worker process. The new artifacts are kept only when the findings changed;
+    otherwise they are removed again and the previous results stay published.
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    while os.path.exists(os.path.join(output_dir, f"vulnerability_scan_{timestamp}.json")):
+        # Never reuse the name of the published scan, which is removed if nothing changed
+        time.sleep(1)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    scan_output = os.path.join(output_dir, f"vulnerability_scan_{timestamp}.json")
+    artifacts = {
+        'scan': scan_output,
+        'sbom': sbom_file,
+        'critical_high_json': os.path.join(output_dir, f"critical_high_vulns_{timestamp}.json"),
+        'critical_high_csv': os.path.join(output_dir, f"critical_high_vulns_{timestamp}.csv"),
+        'stats': os.path.join(output_dir, f"scan_stats_{timestamp}.json"),
+        'snapshot': os.path.join(output_dir, f"vulnerability_scan_{timestamp}.snap")
+    }
+    report = scan_and_report_with_grype(f"sbom:{sbom_file}", scan_output, artifacts['critical_high_json'],
+                                        artifacts['critical_high_csv'], artifacts['stats'],
+                                        f"{scan_output}.gz" if compress else None, artifacts['snapshot'])
+    if not report:
+        return {'image': image_name, 'ok': False, 'changed': False, 'new_findings': [], 'resolved': 0}
+
+    previous = set()
+    if previous_scan and os.path.exists(previous_scan):
+        with open(previous_scan, 'r') as f:
+            previous = {match_key(match) for match in iter_grype_matches(f)}
+    current = set()
+    new_findings = []
+    with open(scan_output, 'r') as f:
+        for match in iter_grype_matches(f):
+            key = match_key(match)
+            current.add(key)
+            if key not in previous:
+                new_findings.append(vulnerability_row(match))
+    resolved = len(previous - current)
+
+    if not new_findings and not resolved:
+        for kind, path in artifacts.items():
+            if kind != 'sbom':
+                os.remove(path)
+        if report['compressed_file']:
+            os.remove(report['compressed_file'])
+        artifacts = None
+    return {
+        'image': image_name,
+        'ok': True,
+        'changed': artifacts is not None,
+        'artifacts': artifacts,
+        'new_findings': new_findings,
+        'resolved': resolved
+    }
+
+
+def rematch_images(manifest, workers=None, force=False, compress=False, store=None, trends=None):
+    """Re-match the stored SBOM of every image in the manifest after a Grype DB update.
+
+    Nothing is pulled or catalogued: Grype only matches each SBOM against the new database,
+    in a pool of worker processes. Images already matched against the current database are
+    skipped unless force is set, and only scans whose findings changed are published.
+    """
+    db_version = update_grype_db()
+    pending = []
+    for image_name, entry in manifest.entries().items():
+        if not force and entry.get('db_version') == db_version:
+            continue
+        if not os.path.exists(entry['artifacts'].get('sbom', '')):
+            print(f"No stored SBOM for {image_name}, rescan it to include it in re-matching")
+            continue
+        pending.append((image_name, entry))
+    if not pending:
+        print(f"Grype DB unchanged ({db_version}), nothing to re-match")
+        return []
+
+    print(f"Re-matching {len(pending)} SBOMs against Grype DB {db_version}")
+    results = []
+    # The database was updated once above, so the workers must not race to update it again
+    with ProcessPoolExecutor(max_workers=workers, initializer=disable_grype_db_update) as executor:
+        futures = {
+            executor.submit(rematch_sbom, image_name, entry['artifacts']['sbom'], entry['artifacts'].get('scan'),
+                            os.path.dirname(entry['artifacts']['sbom']), compress): (image_name, entry)
+            for image_name, entry in pending
+        }
+        for future in as_completed(futures):
+            image_name, entry = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error re-matching {image_name}: {str(e)}")
+                result = {'image': image_name, 'ok': False, 'changed': False, 'new_findings': [], 'resolved': 0}
+            if result['ok']:
+                artifacts = result['artifacts'] or entry['artifacts']
+                if result['changed']:
+                    output_dir = os.path.dirname(artifacts['sbom'])
+                    publish_latest(artifact_links(artifacts, output_dir))
+                    try:
+                        if trends:
+                            trends.append_scan(image_name, artifacts['scan'], artifacts['stats'])
+                        if store:
+                            store.add(image_name, artifacts['scan'], artifacts['sbom'])
+                            prune_stored_files(output_dir, image_name, store)
+                    except Exception as e:
+                        print(f"Error recording history for {image_name}: {str(e)}")
+                # Unchanged results are still current for the new DB, so record that too
+                manifest.record(image_name, entry['digest'], db_version, artifacts)
+            results.append(result)
+    return results
+
+
+def print_rematch_summary(results):
+    """Print the new and resolved findings of each re-matched image"""
+    print("Re-match summary:")
+    for result in sorted(results, key=lambda result: result['image']):
+        if not result['ok']:
+            print(f"{result['image']}: FAILED")
+            continue
+        if not result['changed']:
+            print(f"{result['image']}: unchanged")
+            continue
+        critical_high = [row for row in result['new_findings'] if row['severity'] in ('CRITICAL', 'HIGH')]
+        print(f"{result['image']}: {len(result['new_findings'])} new ({len(critical_high)} critical/high), "
+              f"{result['resolved']} resolved")
+        for row in critical_high:
+            print(f"  {row['id']} ({row['severity']}) - {row['package']} {row['version']}")
+
+
+def print_scan_summary(results):
+    """Print one line per image with its critical/high count and stage timings"""
+    print("Scan summary:")
+    for result in results:
+        status = "FAILED"
+        if result['ok']:
+            status = "unchanged" if result.get('cached') else "ok"
+        timings = ", ".join(f"{stage} {seconds}s" for stage, seconds in result['timings'].items())
+        print(f"{result['image']}: {status}, {len(result['vulnerabilities'])} critical/high ({timings})")
+
+
+def read_images_file(path):
+    """Read image references from a file, one per line, ignoring blanks and # comments"""
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scan a Docker image and generate reports')
+    parser.add_argument('--image', default='python:3.9-slim', help='Docker image to scan (default: python:3.9-slim)')
+    parser.add_argument('--images', nargs='+', help='Scan several images in parallel')
+    parser.add_argument('--images-file', help='File listing images to scan in parallel, one per line')
+    parser.add_argument('--output-dir', default='scans',
+                        help='Directory for per-image results in multi-image mode (default: scans)')
+    parser.add_argument('--workers', type=int, default=4, help='Images scanned concurrently (default: 4)')
+    parser.add_argument('--pull-concurrency', type=int, default=2, help='Concurrent docker pulls (default: 2)')
+    parser.add_argument('--scan-concurrency', type=int, default=2, help='Concurrent Grype scans (default: 2)')
+    parser.add_argument('--sbom-concurrency', type=int, default=2, help='Concurrent Syft runs (default: 2)')
+    parser.add_argument('--upload-concurrency', type=int, default=4, help='Concurrent S3 uploads (default: 4)')
+    parser.add_argument('--sbom-first', action='store_true',
+                        help='Catalogue each image once with Syft and have Grype scan the SBOM')
+    parser.add_argument('--sbom-cache-dir', default='sbom-cache',
+                        help='Directory of SBOMs cached by image digest for --sbom-first (default: sbom-cache)')
+    parser.add_argument('--manifest',
+                        help='Manifest of previous results by image digest '
+                             '(default: scan-manifest.json in the output directory)')
+    parser.add_argument('--package-index',
+                        help='SQLite index of the packages in every scanned image '
+                             '(default: package-index.db next to the manifest)')
+    parser.add_argument('--store',
+                        help='Keep scan history in this deduplicated store and prune older raw files (optional)')
+    parser.add_argument('--force', action='store_true',
+                        help='Rescan even if the image digest and Grype DB are unchanged')
+    parser.add_argument('--compress', action='store_true', help='Also write a gzip copy of each scan')
+    parser.add_argument('--compact-older-than', type=int, metavar='DAYS',
+                        help='Roll up every scan in the manifest, then archive unpublished runs older than DAYS')
+    parser.add_argument('--rematch', action='store_true',
+                        help='Update the Grype DB and re-match the stored SBOM of every image in the manifest')
+    parser.add_argument('--s3-bucket', help='S3 bucket to upload results to (optional)')
+    parser.add_argument('--s3-endpoint-url', help='S3-compatible endpoint to upload to instead of AWS (optional)')
+    args = parser.parse_args()
+    scan_options = {'sbom_first': args.sbom_first, 'sbom_cache_dir': args.sbom_cache_dir, 'force': args.force,
+                    'compress': args.compress}
+
+    images = list(args.images or [])
+    if args.images_file:
+        images.extend(read_images_file(args.images_file))
+
+    history_mode = args.rematch or args.compact_older_than is not None
+    manifest_path = args.manifest or os.path.join(args.output_dir if images or history_mode else '.',
+                                                  'scan-manifest.json')
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    scan_options['manifest'] = ScanManifest(manifest_path)
+    scan_options['package_index'] = PackageIndex(
+        args.package_index or os.path.join(os.path.dirname(manifest_path), 'package-index.db'))
+
+    scan_options['trends'] = TrendStore(os.path.join(os.path.dirname(manifest_path), 'trends.db'))
+    if args.store:
+        scan_options['store'] = ScanStore(args.store)
+
+    if args.compact_older_than is not None:
+        for image_name, entry in scan_options['manifest'].entries().items():
+            compact_scan_history(os.path.dirname(entry['artifacts']['scan']), image_name, scan_options['trends'],
+                                 args.compact_older_than, scan_options.get('store'))
+        return
+
+    if args.rematch:
+        results = rematch_images(scan_options['manifest'], args.workers, args.force, args.compress,
+                                 scan_options.get('store'), scan_options['trends'])
+        if results:
+            print_rematch_summary(results)
+        return
+
+    uploader = None
     if args.s3_bucket:
-        if scan_file:
-            upload_to_s3(scan_file, args.s3_bucket, f"scans/{os.path.basename(scan_file)}")
-        if sbom_file:
-            upload_to_s3(sbom_file, args.s3_bucket, f"sboms/{os.path.basename(sbom_file)}")
+        uploader = S3Uploader(args.s3_bucket, args.upload_concurrency, args.s3_endpoint_url)
+        scan_options['uploader'] = uploader
+
+    try:
+        if not images:
+            result = scan_image(args.image, **scan_options)
+            print("Summary of critical and high vulnerabilities:")
+            for vuln in result['vulnerabilities']:
+                print(f"{vuln['id']} ({vuln['severity']}) - {vuln['package']} {vuln['version']}")
+            return
+
+        results = scan_images(images, args.output_dir, None, args.workers, {
+            'pull': args.pull_concurrency,
+            'scan': args.scan_concurrency,
+            'sbom': args.sbom_concurrency,
+        }, **scan_options)
+        print_scan_summary(results)
+    finally:
+        if uploader:
+            uploader.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -19,7 +19,7 @@ sudo systemctl start docker
 # Install Python and pip
 echo "Installing Python and dependencies..."
 sudo apt-get install -y python3 python3-pip
-pip3 install flask requests
+pip3 install flask requests boto3
 
 # Install AWS CLI
 echo "Installing AWS CLI..."
@@ -50,6 +50,12 @@ cat << EOF > ~/docker-scan/config.json
   "scan_results_path": "vulnerability_scan.json",
   "sbom_path": "sbom.json",
   "critical_high_vulns_path": "critical_high_vulns.json",
+  "scans_dir": "scans",
+  "jobs_db_path": "scan_jobs.db",
+  "scan_workers": 2,
+  "package_index_path": "scans/package-index.db",
+  "scan_store_path": "scans/scan-store.db",
+  "trends_path": "scans/trends.db",
   "port": 8000,
   "allowed_origins": ["*"]
 }